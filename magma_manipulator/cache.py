@@ -0,0 +1,136 @@
+# Copyright 2019 Mirantis Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import threading
+import time
+
+# Seconds a response of the endpoint is used without asking orc8r again.
+# With a zero TTL the response is still kept when orc8r sent an ETag or
+# Last-Modified header and every read becomes a conditional request.
+DEFAULT_TTLS = {
+    'networks': 60,
+    'network_type': 3600,
+    'gateways': 30,
+    'gateway_config': 0,
+    'network_gateways': 0,
+}
+# Streamed listings with more items than this are not cached, they would
+# have to be collected in memory as a whole.
+DEFAULT_MAX_STREAMED_ITEMS = 1000
+
+
+class CacheEntry(object):
+    __slots__ = ('endpoint', 'data', 'etag', 'last_modified', 'expires_at')
+
+    def __init__(self, endpoint, data, etag, last_modified, expires_at):
+        self.endpoint = endpoint
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+    def is_fresh(self):
+        return time.monotonic() < self.expires_at
+
+    def can_revalidate(self):
+        return bool(self.etag or self.last_modified)
+
+    def get_validators(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache(object):
+    def __init__(self, ttls=None,
+                 max_streamed_items=DEFAULT_MAX_STREAMED_ITEMS):
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.max_streamed_items = max_streamed_items
+        self._entries = {}
+        self._stats = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+
+    def get_ttl(self, endpoint):
+        return self.ttls.get(endpoint, 0)
+
+    def lookup(self, url, endpoint):
+        # Returns (entry, fresh). A stale entry is returned so the caller
+        # can revalidate it with a conditional request.
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None and entry.is_fresh():
+                self._stats[endpoint]['hits'] += 1
+                return entry, True
+            if entry is not None and not entry.can_revalidate():
+                # nothing to send a conditional request with
+                del self._entries[url]
+                self._stats[endpoint]['evictions'] += 1
+                entry = None
+            self._stats[endpoint]['misses'] += 1
+            return entry, False
+
+    def wants(self, endpoint, resp_headers):
+        return self.get_ttl(endpoint) > 0 or \
+            'ETag' in resp_headers or 'Last-Modified' in resp_headers
+
+    def store(self, url, endpoint, data, resp_headers):
+        if not self.wants(endpoint, resp_headers):
+            return
+        entry = CacheEntry(endpoint, data,
+                           resp_headers.get('ETag'),
+                           resp_headers.get('Last-Modified'),
+                           time.monotonic() + self.get_ttl(endpoint))
+        with self._lock:
+            self._evict_expired()
+            self._entries[url] = entry
+            self._stats[endpoint]['stores'] += 1
+
+    def _evict_expired(self):
+        # drops entries of urls which are not read any more
+        for url, entry in list(self._entries.items()):
+            if not entry.is_fresh() and not entry.can_revalidate():
+                del self._entries[url]
+                self._stats[entry.endpoint]['evictions'] += 1
+
+    def revalidated(self, url, entry):
+        # orc8r answered 304 Not Modified for the entry
+        with self._lock:
+            entry.expires_at = time.monotonic() + self.get_ttl(entry.endpoint)
+            self._entries[url] = entry
+            self._stats[entry.endpoint]['revalidations'] += 1
+
+    def invalidate(self, url, prefix=False):
+        with self._lock:
+            if prefix:
+                urls = [u for u in self._entries if u.startswith(url)]
+            else:
+                urls = [url] if url in self._entries else []
+            for u in urls:
+                entry = self._entries.pop(u)
+                self._stats[entry.endpoint]['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {endpoint: dict(counter)
+                    for endpoint, counter in self._stats.items()}
@@ -13,8 +13,10 @@
 #    under the License.
 
 import os
-from jsonschema import validate
-import yaml
+import threading
+
+CONFIG_ENV_VAR = 'MAGMA_MANIPULATOR_CONFIG'
+DEFAULT_CONFIG_PATH = 'config.yml'
 
 schema = """
     type: object
@@ -26,8 +28,59 @@ schema = """
             type: string
           namespace:
             type: string
+          targets:
+            type: array
+            items:
+              type: object
+              properties:
+                kubeconfig_path:
+                  type: string
+                namespace:
+                  type: string
+              required:
+                - kubeconfig_path
+                - namespace
       orc8r_api_url:
         type: string
+      orc8r_limits:
+        type: object
+        properties:
+          rate:
+            type: number
+          burst:
+            type: number
+          min_concurrency:
+            type: integer
+          max_concurrency:
+            type: integer
+          latency_target:
+            type: number
+      orc8r_resilience:
+        type: object
+        properties:
+          connect_timeout:
+            type: number
+          read_timeout:
+            type: number
+          retries:
+            type: integer
+          backoff_base:
+            type: number
+          backoff_cap:
+            type: number
+          failure_threshold:
+            type: integer
+          reset_timeout:
+            type: number
+      orc8r_cache:
+        type: object
+        properties:
+          ttl:
+            type: object
+            additionalProperties:
+              type: number
+          max_streamed_items:
+            type: integer
       magma_certs_path:
         type: array
       gateways:
@@ -39,18 +92,92 @@ schema = """
             type: string
           rsa_private_key_path:
             type: string
+          refresh_interval:
+            type: integer
+          reconcile_interval:
+            type: integer
+      sharding:
+        type: object
+        properties:
+          enabled:
+            type: boolean
+          namespace:
+            type: string
+          replica_id:
+            type: string
+          lease_duration:
+            type: integer
+          renew_interval:
+            type: integer
+      logging:
+        type: object
+        properties:
+          level:
+            type: string
+            enum: [DEBUG, INFO, WARNING, ERROR, debug, info, warning, error]
+          format:
+            type: string
+            enum: [text, json]
+          rate_limit:
+            type: object
+            properties:
+              period:
+                type: number
+              burst:
+                type: integer
 """
 
 
+_lock = threading.Lock()
+_parsed_schema = None
+_config_path = None
+_config = None
+
+
+def _get_schema():
+    global _parsed_schema
+    if _parsed_schema is None:
+        import yaml
+        _parsed_schema = yaml.safe_load(schema)
+    return _parsed_schema
+
+
 def parse_config(cfg_rel_path):
+    import yaml
+    from jsonschema import validate
+
     dirname = os.path.dirname(__file__)
     cfg_path = os.path.join(dirname, cfg_rel_path)
     with open(cfg_path, 'r') as ymlfile:
         yml_cfg = yaml.load(ymlfile, Loader=yaml.FullLoader)
-    validate(yml_cfg, yaml.load(schema))
+    validate(yml_cfg, _get_schema())
     return yml_cfg
 
 
+def set_config_path(cfg_path):
+    global _config_path, _config
+    with _lock:
+        _config_path = cfg_path
+        _config = None
+
+
+def get_config_path():
+    # paths given by the user are relative to the working directory, the
+    # default config.yml is looked up next to the package
+    cfg_path = _config_path or os.environ.get(CONFIG_ENV_VAR)
+    if cfg_path:
+        return os.path.abspath(cfg_path)
+    return DEFAULT_CONFIG_PATH
+
+
+def load_config():
+    global _config
+    with _lock:
+        if _config is None:
+            _config = Config(parse_config(get_config_path()))
+        return _config
+
+
 class Config(object):
     def __init__(self, yml_cfg):
         for k, v in yml_cfg.items():
@@ -59,5 +186,15 @@ class Config(object):
             else:
                 self.__dict__[k] = v
 
+    def get(self, key, default=None):
+        return self.__dict__.get(key, default)
+
+
+class LazyConfig(object):
+    # Defers reading config.yml until the first option is accessed, so
+    # importing modules does not require a config file to be present.
+    def __getattr__(self, name):
+        return getattr(load_config(), name)
+
 
-cfg = Config(parse_config('config.yml'))
+cfg = LazyConfig()
@@ -23,6 +23,16 @@ class SshRemoteCommandException(Exception):
         super().__init__(message)
 
 
+class SshTimeoutException(SshRemoteCommandException):
+    def __init__(self, message):
+        super().__init__(message)
+
+
 class MagmaRequestException(Exception):
     def __init__(self, message):
         super().__init__(message)
+
+
+class CircuitOpenException(MagmaRequestException):
+    def __init__(self, message):
+        super().__init__(message)
@@ -0,0 +1,271 @@
+# Copyright 2019 Mirantis Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+from concurrent import futures
+import logging
+import time
+
+from magma_manipulator.config_parser import cfg as CONF
+from magma_manipulator import exceptions
+from magma_manipulator import gateways
+from magma_manipulator import k8s_tools
+from magma_manipulator import logs
+from magma_manipulator import magma_api
+from magma_manipulator import registration
+from magma_manipulator import utils
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 10
+DEFAULT_READY_TIMEOUT = 900
+DEFAULT_POLL_INTERVAL = 10
+
+STATUS_REGISTERED = 'registered'
+STATUS_NOT_READY = 'not ready'
+STATUS_NO_POD = 'no pod'
+STATUS_UNKNOWN = 'unknown gateway'
+STATUS_OK = 'ok'
+STATUS_NOT_IN_ORC8R = 'not registered'
+STATUS_HARDWARE_ID_MISMATCH = 'hardware id mismatch'
+STATUS_KEY_MISMATCH = 'key mismatch'
+STATUS_TIMED_OUT = 'timed out'
+
+GatewayPod = collections.namedtuple(
+    'GatewayPod', ['name', 'uid', 'ip', 'target'])
+
+RegistrationResult = collections.namedtuple(
+    'RegistrationResult',
+    ['gw_name', 'gw_id', 'network', 'pod_name', 'status', 'elapsed'])
+
+AuditResult = collections.namedtuple(
+    'AuditResult',
+    ['gw_name', 'gw_id', 'network', 'pod_name', 'status', 'elapsed'])
+
+
+def add_register_parser(subparsers):
+    parser = subparsers.add_parser(
+        'register',
+        help='Register a set of gateways concurrently and exit')
+    selection = parser.add_mutually_exclusive_group(required=True)
+    selection.add_argument(
+        '--all', action='store_true',
+        help='Register all gateways known to orc8r')
+    selection.add_argument(
+        '--network', action='append',
+        help='Register all gateways of the network. Can be repeated')
+    selection.add_argument(
+        '--manifest',
+        help='YAML or JSON file with a list of gateway names')
+    parser.add_argument(
+        '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+        help='Number of gateways registered at the same time '
+             '(default: {default})'.format(default=DEFAULT_CONCURRENCY))
+    parser.add_argument(
+        '--timeout', type=int, default=DEFAULT_READY_TIMEOUT,
+        help='Seconds to wait for a gateway pod to become ready '
+             '(default: {default})'.format(default=DEFAULT_READY_TIMEOUT))
+    parser.add_argument(
+        '--poll-interval', type=int, default=DEFAULT_POLL_INTERVAL,
+        help='Seconds between readiness checks of a gateway pod '
+             '(default: {default})'.format(default=DEFAULT_POLL_INTERVAL))
+    return parser
+
+
+def add_audit_parser(subparsers):
+    parser = subparsers.add_parser(
+        'audit',
+        help='Compare hardware ids and keys of running gateways with orc8r')
+    parser.add_argument(
+        '--network', action='append',
+        help='Audit only gateways of the network. Can be repeated')
+    parser.add_argument(
+        '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+        help='Number of gateways queried over SSH at the same time '
+             '(default: {default})'.format(default=DEFAULT_CONCURRENCY))
+    return parser
+
+
+def load_manifest(manifest_path):
+    import yaml
+
+    with open(manifest_path, 'r') as f:
+        data = yaml.safe_load(f)
+    if isinstance(data, dict):
+        data = data.get('gateways', [])
+    return [str(gw_name) for gw_name in data or []]
+
+
+def find_gateway_pods(gws_manager, targets):
+    gw_pods = {}
+    for target in targets:
+        for pod in k8s_tools.list_pods(target.kubeconfig_path,
+                                       target.namespace):
+            try:
+                gw = gws_manager.get_gateway(pod.metadata.name)
+            except KeyError:
+                continue
+            gw_pods[gw.name] = GatewayPod(pod.metadata.name,
+                                          pod.metadata.uid,
+                                          pod.status.pod_ip, target)
+    return gw_pods
+
+
+def _result(gw, pod_name, status, start):
+    return RegistrationResult(gw.name, gw.id, gw.network, pod_name,
+                              status, time.monotonic() - start)
+
+
+def _register_one(gw, gw_pod, ready_timeout, poll_interval):
+    start = time.monotonic()
+    if gw_pod is None:
+        return _result(gw, None, STATUS_NO_POD, start)
+
+    while True:
+        try:
+            if registration.register_gateway(gw, gw_pod.name, gw_pod.uid,
+                                             gw_pod.target):
+                return _result(gw, gw_pod.name, STATUS_REGISTERED, start)
+        except (exceptions.SshRemoteCommandException,
+                exceptions.CloudInitException) as e:
+            # a starting pod answers ping before sshd and cloud-init are up
+            LOG.info('Gateway %s is not ready yet: %s', gw.name, e,
+                     extra=logs.RATE_LIMITED)
+        except Exception as e:
+            LOG.error('Registration of gateway {gw_name} failed: '
+                      '{err}'.format(gw_name=gw.name, err=e))
+            return _result(gw, gw_pod.name, 'failed: {err}'.format(err=e),
+                           start)
+        if time.monotonic() - start + poll_interval > ready_timeout:
+            return _result(gw, gw_pod.name, STATUS_NOT_READY, start)
+        time.sleep(poll_interval)
+
+
+def _audit_result(gw, pod_name, status, start):
+    return AuditResult(gw.name, gw.id, gw.network, pod_name,
+                       status, time.monotonic() - start)
+
+
+def _audit_one(gw, gw_pod, device):
+    start = time.monotonic()
+    if gw_pod is None or not gw_pod.ip:
+        return _audit_result(gw, gw_pod and gw_pod.name, STATUS_NO_POD, start)
+    if device is None:
+        return _audit_result(gw, gw_pod.name, STATUS_NOT_IN_ORC8R, start)
+
+    try:
+        gw_uuid, gw_key = utils.get_gw_uuid_and_key(
+            gw_pod.ip, CONF.gateways.username,
+            CONF.gateways.rsa_private_key_path)
+    except exceptions.SshTimeoutException:
+        return _audit_result(gw, gw_pod.name, STATUS_TIMED_OUT, start)
+    except Exception as e:
+        LOG.error('Audit of gateway {gw_name} failed: {err}'.format(
+            gw_name=gw.name, err=e))
+        return _audit_result(gw, gw_pod.name,
+                             'failed: {err}'.format(err=e), start)
+    finally:
+        utils.close_ssh_connection(gw_pod.ip, CONF.gateways.username)
+
+    if gw_uuid != device.get('hardware_id'):
+        status = STATUS_HARDWARE_ID_MISMATCH
+    elif gw_key != (device.get('key') or {}).get('key'):
+        status = STATUS_KEY_MISMATCH
+    else:
+        status = STATUS_OK
+    return _audit_result(gw, gw_pod.name, status, start)
+
+
+def get_orc8r_devices(gws_manager):
+    # one gateways listing per network instead of a request per gateway
+    devices = {}
+    for network in gws_manager.get_gateways().get_networks():
+        gws = gws_manager.get_network_gateways(network)
+        if not gws:
+            continue
+        for gw_id, gw_desc in magma_api.iter_gateways(
+                CONF.orc8r_api_url, network, gws[0].network_type,
+                CONF.magma_certs_path):
+            devices[gw_id] = gw_desc.get('device') or {}
+    return devices
+
+
+def format_results(results):
+    header = ('GATEWAY', 'ID', 'NETWORK', 'POD', 'RESULT', 'TIME')
+    rows = [header]
+    for r in results:
+        rows.append((r.gw_name, r.gw_id or '-', r.network or '-',
+                     r.pod_name or '-', r.status,
+                     '{sec:.1f}s'.format(sec=r.elapsed)))
+    widths = [max(len(str(row[i])) for row in rows)
+              for i in range(len(header))]
+    return '\n'.join('  '.join(str(col).ljust(width)
+                               for col, width in zip(row, widths)).rstrip()
+                     for row in rows)
+
+
+def register_fleet(args):
+    gws_manager = gateways.GatewaysManager(networks=args.network)
+    selected = dict(gws_manager.get_gateways())
+
+    results = []
+    if args.manifest:
+        names = load_manifest(args.manifest)
+        for gw_name in names:
+            if gw_name not in selected:
+                results.append(RegistrationResult(
+                    gw_name, None, None, None, STATUS_UNKNOWN, 0.0))
+        selected = {name: selected[name]
+                    for name in names if name in selected}
+
+    gw_pods = find_gateway_pods(gws_manager,
+                                k8s_tools.get_targets(CONF.k8s))
+
+    LOG.info('Register {count} gateways with concurrency {concurrency}'
+             .format(count=len(selected), concurrency=args.concurrency))
+    with futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        jobs = [pool.submit(_register_one, gw, gw_pods.get(gw_name),
+                            args.timeout, args.poll_interval)
+                for gw_name, gw in sorted(selected.items())]
+        results.extend(job.result() for job in jobs)
+
+    print(format_results(results))
+    if all(r.status == STATUS_REGISTERED for r in results):
+        return 0
+    return 1
+
+
+def audit_fleet(args):
+    gws_manager = gateways.GatewaysManager(networks=args.network,
+                                           fetch_configs=False)
+    selected = gws_manager.get_gateways()
+    gw_pods = find_gateway_pods(gws_manager,
+                                k8s_tools.get_targets(CONF.k8s))
+    devices = get_orc8r_devices(gws_manager)
+
+    LOG.info('Audit {count} gateways with concurrency {concurrency}'
+             .format(count=len(selected), concurrency=args.concurrency))
+    start = time.monotonic()
+    with futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        jobs = [pool.submit(_audit_one, gw, gw_pods.get(gw_name),
+                            devices.get(gw.id))
+                for gw_name, gw in sorted(selected.items())]
+        results = [job.result() for job in jobs]
+    LOG.info('Audited {count} gateways in {sec:.1f}s'.format(
+        count=len(results), sec=time.monotonic() - start))
+
+    print(format_results(results))
+    if all(r.status == STATUS_OK for r in results):
+        return 0
+    return 1
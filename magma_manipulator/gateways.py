@@ -12,80 +12,366 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+from collections import abc
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
 from magma_manipulator.config_parser import cfg as CONF
 from magma_manipulator import k8s_tools
 from magma_manipulator import magma_api
 from magma_manipulator import utils
 
+LOG = logging.getLogger(__name__)
+
+# gateway status changes at every checkin and does not affect registration
+FINGERPRINT_IGNORED_KEYS = ('status',)
+
+# seconds the orc8r check made by Gateway.prewarm() stays valid
+PREWARM_MAX_AGE = 120
+# guards the pod uids prewarm was started for
+_prewarm_lock = threading.Lock()
+
+# hits and misses of the pod identity data cached in gateways
+_identity_stats = collections.Counter()
+_identity_stats_lock = threading.Lock()
+
+
+def _count_identity(name):
+    with _identity_stats_lock:
+        _identity_stats[name] += 1
+
+
+def get_identity_cache_stats():
+    with _identity_stats_lock:
+        return dict(_identity_stats)
+
 
 class GatewaysManager(object):
-    _gateways = {}
-
-    def __init__(self):
-        self._get_magma_gateways()
-
-    def _get_magma_gateways(self):
-        networks = magma_api.get_networks(
-            CONF.orc8r_api_url, CONF.magma_certs_path)
-        for net in networks:
-            net_type = magma_api.get_network_type(
-                CONF.orc8r_api_url, net, CONF.magma_certs_path)
-            gws = magma_api.get_gateways(
-                CONF.orc8r_api_url, net, net_type, CONF.magma_certs_path)
-            for gw_id, gw_desc in gws.items():
-                gw_config = magma_api.get_gateway_config(
-                    CONF.orc8r_api_url, net, net_type,
-                    gw_id, CONF.magma_certs_path)
-                config_path = utils.save_gateway_config(
-                        gw_id, CONF.gateways.configs_dir, gw_config)
-
-                self._gateways[gw_desc['name']] = Gateway(
-                        gw_id, gw_desc['name'], net, net_type, config_path)
+    def __init__(self, shard=None, networks=None, fetch_configs=True):
+        self._shard = shard
+        self._networks = networks
+        # read-only users of the inventory do not pull and save configs
+        self._fetch_configs = fetch_configs
+        self._gateways = GatewayInventory()
+        self._refresh_lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        # Builds a new index from the orc8r listings and swaps it in at once,
+        # so event handling keeps using the old index meanwhile. Known
+        # gateways are carried over together with their cached pod data and
+        # configs are fetched only for new or changed gateways.
+        with self._refresh_lock:
+            current = self._gateways
+            gateways = {}
+            added = []
+            changed = []
+
+            networks = self._networks
+            if networks is None:
+                networks = magma_api.get_networks(
+                    CONF.orc8r_api_url, CONF.magma_certs_path)
+            for net in networks:
+                net_type = magma_api.get_network_type(
+                    CONF.orc8r_api_url, net, CONF.magma_certs_path)
+                # the listing is read to the end first, so its streamed
+                # response is closed before any config is requested
+                listing = [(gw_id, gw_desc['name'], _get_fingerprint(gw_desc))
+                           for gw_id, gw_desc in magma_api.iter_gateways(
+                               CONF.orc8r_api_url, net, net_type,
+                               CONF.magma_certs_path)]
+                for gw_id, gw_name, fingerprint in listing:
+                    old_gw = current.get(gw_name)
+                    if old_gw is not None and old_gw.id == gw_id and \
+                       old_gw.network == net:
+                        gateways[gw_name] = old_gw
+                        if old_gw.fingerprint != fingerprint:
+                            # e.g. the device after our own re-registration
+                            old_gw.update(fingerprint, self._fetch_config(
+                                gw_id, gw_name, net, net_type))
+                            changed.append(gw_name)
+                        continue
+
+                    if old_gw is not None:
+                        old_gw.close()
+                        changed.append(gw_name)
+                    else:
+                        added.append(gw_name)
+                    gateways[gw_name] = Gateway(
+                        gw_id, gw_name, net, net_type,
+                        self._fetch_config(gw_id, gw_name, net, net_type),
+                        fingerprint)
+
+            removed = [name for name in current if name not in gateways]
+            for name in removed:
+                current[name].close()
+            self._gateways = GatewayInventory(gateways.values())
+            LOG.info('Gateways inventory refreshed: %d gateways, added %d, '
+                     'changed %d, removed %d', len(gateways), len(added),
+                     len(changed), len(removed))
+            LOG.debug('Gateways added %s, changed %s, removed %s',
+                      added, changed, removed)
+            return added, changed, removed
+
+    def _fetch_config(self, gw_id, gw_name, net, net_type):
+        # configs of gateways owned by other replicas are pulled
+        # later if the gateway is moved to this replica
+        if not self._fetch_configs or not self._owns(gw_name):
+            return None
+        gw_config = magma_api.get_gateway_config(
+            CONF.orc8r_api_url, net, net_type,
+            gw_id, CONF.magma_certs_path)
+        return utils.save_gateway_config(
+                gw_id, CONF.gateways.configs_dir, gw_config)
+
+    def _owns(self, gw_name):
+        return self._shard is None or self._shard.owns(gw_name)
 
     def get_gateway(self, gw_pod_name):
-        gw_name = gw_pod_name.split('-')[0]
-        return self._gateways[gw_name]
+        gw = self._gateways.match_pod_name(gw_pod_name)
+        if gw is None:
+            raise KeyError(gw_pod_name)
+        return gw
+
+    def find_gateway(self, gw_pod_name):
+        return self._gateways.match_pod_name(gw_pod_name)
+
+    def get_gateway_by_id(self, gw_id):
+        return self._gateways.get_by_id(gw_id)
+
+    def get_network_gateways(self, network):
+        return self._gateways.get_by_network(network)
 
     def get_gateways(self):
         return self._gateways
 
     def delete_gateway(self, gw_name):
-        del self._gateways[gw_name]
+        with self._refresh_lock:
+            gateways = self._gateways
+            del_gw = gateways[gw_name]
+            self._gateways = GatewayInventory(
+                gw for gw in gateways.values() if gw is not del_gw)
 
     def get_gateway_names(self):
         return list(self._gateways.keys())
 
 
+def _get_fingerprint(gw_desc):
+    desc = {k: v for k, v in gw_desc.items()
+            if k not in FINGERPRINT_IGNORED_KEYS}
+    digest = hashlib.blake2b(json.dumps(desc, sort_keys=True).encode('utf-8'),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class GatewayInventory(abc.Mapping):
+    # Read-only mapping of gateway name to Gateway with secondary indexes.
+    # A refresh builds a new inventory instead of modifying this one.
+    def __init__(self, gateways=()):
+        self._by_name = {}
+        self._by_id = {}
+        self._by_network = {}
+        for gw in gateways:
+            self._by_name[gw.name] = gw
+            self._by_id[gw.id] = gw
+            self._by_network.setdefault(gw.network, []).append(gw)
+
+    def __getitem__(self, gw_name):
+        return self._by_name[gw_name]
+
+    def __iter__(self):
+        return iter(self._by_name)
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def get_by_id(self, gw_id):
+        return self._by_id.get(gw_id)
+
+    def get_by_network(self, network):
+        return list(self._by_network.get(network, ()))
+
+    def get_networks(self):
+        return list(self._by_network)
+
+    def match_pod_name(self, pod_name):
+        # Pod names are the gateway name followed by dash separated suffixes
+        # and gateway names may contain dashes themselves, so the longest
+        # dash-bounded prefix of the pod name that is a gateway name wins.
+        name = pod_name
+        while True:
+            gw = self._by_name.get(name)
+            if gw is not None:
+                return gw
+            idx = name.rfind('-')
+            if idx <= 0:
+                return None
+            name = name[:idx]
+
+
 class Gateway(object):
+    __slots__ = ('id', 'name', 'fingerprint', 'network', 'network_type',
+                 'config_path', 'registered_pod_uid', '_ip', '_uuid', '_key',
+                 '_pod_name', '_pod_uid', '_prewarm_uid', '_config',
+                 '_in_orc8r', '_in_orc8r_at', '_lock')
+
     def __init__(self, gw_id, gw_name, gw_network,
-                 gw_network_type, gw_config_path):
+                 gw_network_type, gw_config_path, fingerprint=None):
         self.id = gw_id
         self.name = gw_name
+        self.fingerprint = fingerprint
 
-        self.network = gw_network
-        self.network_type = gw_network_type
+        # a handful of networks is shared by all gateways
+        self.network = sys.intern(gw_network)
+        self.network_type = sys.intern(gw_network_type)
 
         self.config_path = gw_config_path
+        # uid of the pod the gateway was last registered from
+        self.registered_pod_uid = None
 
         self._ip = None
         self._uuid = None
         self._key = None
         self._pod_name = None
+        self._pod_uid = None
+        self._prewarm_uid = None
+        self._config = None
+        self._in_orc8r = None
+        self._in_orc8r_at = 0.0
+        # prewarm and registration of the same pod run in different threads
+        self._lock = threading.RLock()
+
+    def update(self, fingerprint, config_path):
+        # the orc8r record changed, data of the running pod stays valid
+        self.fingerprint = fingerprint
+        if config_path is not None:
+            self.config_path = config_path
+        self._config = None
 
-    def get_ip(self, pod_name):
-        if not self._ip:
-            self._ip = k8s_tools.get_gw_ip(CONF.k8s.kubeconfig_path,
-                                           CONF.k8s.namespace,
-                                           pod_name)
-            self._pod_name = pod_name
-        return self._ip
+    def close(self):
+        # the gateway is dropped from the inventory
+        with self._lock:
+            if self._ip:
+                utils.close_ssh_connection(self._ip, CONF.gateways.username)
+
+    def _switch_pod(self, pod_name, pod_uid):
+        # IP, hardware id and key belong to a pod instance. A recreated pod
+        # keeps its name but gets a new uid, so the data of the previous
+        # instance must not be used for it. Called with the lock held.
+        if pod_name == self._pod_name and pod_uid == self._pod_uid:
+            return
+        if self._pod_name is not None:
+            _count_identity('invalidations')
+            LOG.debug('Forget pod %s data of gateway %s, new pod %s %s',
+                      self._pod_uid, self.name, pod_name, pod_uid)
+        if self._ip:
+            utils.close_ssh_connection(self._ip, CONF.gateways.username)
+        self._ip = None
+        self._uuid = None
+        self._key = None
+        self._in_orc8r = None
+        self._pod_name = pod_name
+        self._pod_uid = pod_uid
+
+    def get_ip(self, pod_name, pod_uid, target):
+        with self._lock:
+            self._switch_pod(pod_name, pod_uid)
+            if self._ip:
+                _count_identity('ip_hits')
+            else:
+                _count_identity('ip_misses')
+                self._ip = k8s_tools.get_gw_ip(target.kubeconfig_path,
+                                               target.namespace,
+                                               pod_name)
+            return self._ip
 
     def get_uuid_and_key(self):
-        if not self._uuid and not self._key:
-            self._uuid, self._key = utils.get_gw_uuid_and_key(
-                self._ip, CONF.gateways.username,
-                CONF.gateways.rsa_private_key_path)
-        return (self._uuid, self._key)
+        # must be called after get_ip() for the same pod
+        with self._lock:
+            if self._uuid and self._key:
+                _count_identity('uuid_hits')
+            else:
+                _count_identity('uuid_misses')
+                self._uuid, self._key = utils.get_gw_uuid_and_key(
+                    self._ip, CONF.gateways.username,
+                    CONF.gateways.rsa_private_key_path)
+            return (self._uuid, self._key)
+
+    def get_cached_uuid(self, pod_uid):
+        # hardware id of the pod if it was already read, without SSH
+        with self._lock:
+            if pod_uid == self._pod_uid:
+                return self._uuid
+            return None
 
     def get_config(self):
-        return utils.load_gateway_config(self.name, self.config_path)
+        # the config file is re-read only after the puller has rewritten it
+        mtime = os.path.getmtime(self.config_path)
+        if self._config is not None and \
+           self._config[0] == self.config_path and self._config[1] == mtime:
+            return self._config[2]
+        config = utils.load_gateway_config(self.name, self.config_path)
+        self._config = (self.config_path, mtime, config)
+        return config
+
+    def is_in_orc8r(self, max_age=0):
+        # max_age allows to reuse the result of a check made while the
+        # gateway pod was starting
+        with self._lock:
+            if self._in_orc8r is None or \
+               time.monotonic() - self._in_orc8r_at > max_age:
+                self._in_orc8r = magma_api.is_gateway_in_network(
+                    CONF.orc8r_api_url, self.network, self.id,
+                    CONF.magma_certs_path)
+                self._in_orc8r_at = time.monotonic()
+            return self._in_orc8r
+
+    def forget_orc8r_state(self):
+        with self._lock:
+            self._in_orc8r = None
+
+    def claim_prewarm(self, pod_uid):
+        # Every early event of a pod asks for prewarm, only one of them
+        # runs at a time. The claim is kept once the pod IP is resolved,
+        # until then later events of the pod prewarm again.
+        with _prewarm_lock:
+            if self._prewarm_uid == pod_uid:
+                return False
+            self._prewarm_uid = pod_uid
+            return True
+
+    def prewarm(self, pod_name, pod_uid, target):
+        # Does the slow parts of the registration while the pod is still
+        # being scheduled or pulled, so only the registration itself is
+        # left when the pod is started. Every step is best effort and
+        # reuses what is still fresh.
+        LOG.info('Prewarm gateway %s for pod %s', self.name, pod_name)
+        with self._lock:
+            self._switch_pod(pod_name, pod_uid)
+            try:
+                if self.config_path:
+                    self.get_config()
+                self.is_in_orc8r(max_age=PREWARM_MAX_AGE)
+            except Exception as e:
+                LOG.debug('Prewarm of orc8r data for %s failed: %s',
+                          self.name, e)
+            gw_ip = None
+            try:
+                gw_ip = self.get_ip(pod_name, pod_uid, target)
+                if gw_ip:
+                    utils.open_ssh_connection(
+                        gw_ip, CONF.gateways.username,
+                        CONF.gateways.rsa_private_key_path)
+            except Exception as e:
+                LOG.debug('Prewarm of pod %s failed: %s', pod_name, e)
+            if not gw_ip:
+                # a scheduled pod has no IP yet
+                with _prewarm_lock:
+                    if self._prewarm_uid == pod_uid:
+                        self._prewarm_uid = None
@@ -0,0 +1,68 @@
+# Copyright 2019 Mirantis Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+# Decoding of orc8r responses. orjson and ijson are optional: orjson is used
+# to parse whole documents when it is installed and ijson to iterate over
+# large JSON objects without loading them at once. Without them the standard
+# json module is used.
+
+import json
+import logging
+
+LOG = logging.getLogger(__name__)
+
+_loads_func = None
+_ijson_module = None
+_ijson_checked = False
+
+
+def _get_loads():
+    global _loads_func
+    if _loads_func is None:
+        try:
+            import orjson
+            _loads_func = orjson.loads
+            LOG.debug('Use orjson to decode orc8r responses')
+        except ImportError:
+            _loads_func = json.loads
+    return _loads_func
+
+
+def _get_ijson():
+    global _ijson_module, _ijson_checked
+    if not _ijson_checked:
+        try:
+            import ijson
+            _ijson_module = ijson
+            LOG.debug('Use ijson {backend} backend to iterate over orc8r '
+                      'responses'.format(backend=ijson.backend))
+        except ImportError:
+            _ijson_module = None
+        _ijson_checked = True
+    return _ijson_module
+
+
+def loads(data):
+    # data is the raw response body, it is parsed without decoding it to str
+    return _get_loads()(data)
+
+
+def iter_items(fileobj):
+    # Yields (key, value) pairs of the top level JSON object read from
+    # fileobj one by one when ijson is installed.
+    ijson = _get_ijson()
+    if ijson is None:
+        yield from loads(fileobj.read()).items()
+        return
+    yield from ijson.kvitems(fileobj, '', use_float=True)
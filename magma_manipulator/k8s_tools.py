@@ -12,36 +12,137 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import logging
+import threading
 
-from kubernetes import client, config
+from magma_manipulator import logs
 
 LOG = logging.getLogger(__name__)
 
+K8S_MICRO_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+K8sTarget = collections.namedtuple('K8sTarget',
+                                   ['kubeconfig_path', 'namespace'])
+
+_api_clients = {}
+_api_clients_lock = threading.Lock()
+
+
+def get_targets(k8s_conf):
+    targets = k8s_conf.get('targets')
+    if not targets:
+        return [K8sTarget(k8s_conf.kubeconfig_path, k8s_conf.namespace)]
+    return [K8sTarget(t['kubeconfig_path'], t['namespace'])
+            for t in targets]
+
+
+def _get_api_client(kubeconfig_path):
+    # one client (and one connection pool) per cluster shared by all threads
+    from kubernetes import config
+
+    with _api_clients_lock:
+        if kubeconfig_path not in _api_clients:
+            _api_clients[kubeconfig_path] = config.new_client_from_config(
+                config_file=kubeconfig_path)
+        return _api_clients[kubeconfig_path]
+
+
+def _core_v1(kubeconfig_path):
+    from kubernetes import client
+
+    return client.CoreV1Api(_get_api_client(kubeconfig_path))
+
+
+def _coordination_v1(kubeconfig_path):
+    from kubernetes import client
+
+    return client.CoordinationV1Api(_get_api_client(kubeconfig_path))
+
+
+def watch_events(kubeconfig_path, kube_namespace):
+    from kubernetes import watch
+
+    v1 = _core_v1(kubeconfig_path)
+    w = watch.Watch()
+    return w.stream(v1.list_namespaced_event,
+                    kube_namespace, timeout_seconds=0)
+
 
 def get_gw_ip(kubeconfig_path, kube_namespace, gw_pod_name):
-    config.load_kube_config(config_file=kubeconfig_path)
-    v1 = client.CoreV1Api()
+    v1 = _core_v1(kubeconfig_path)
 
-    LOG.info('Trying to get gateway IP adress for '
-             '{gw_pod_name} from kubernetes'.format(gw_pod_name=gw_pod_name))
+    LOG.info('Trying to get gateway IP adress for %s from kubernetes',
+             gw_pod_name, extra=logs.RATE_LIMITED)
     pod = v1.read_namespaced_pod_status(gw_pod_name, kube_namespace)
-    LOG.info('Gateway IP address ({gw_pod_name}) received '
-             'from kubernetes: {gw_ip}'.format(gw_pod_name=gw_pod_name,
-                                               gw_ip=pod.status.pod_ip))
+    LOG.info('Gateway IP address (%s) received from kubernetes: %s',
+             gw_pod_name, pod.status.pod_ip, extra=logs.RATE_LIMITED)
     return pod.status.pod_ip
 
 
 def is_pod_ready(kubeconfig_path, kube_namespace, gw_pod_name):
-    config.load_kube_config(config_file=kubeconfig_path)
-    v1 = client.CoreV1Api()
+    v1 = _core_v1(kubeconfig_path)
 
     result = v1.read_namespaced_pod_status(gw_pod_name, kube_namespace)
     for container in result.status.container_statuses:
         if not container.ready:
-            LOG.info('Containers in pod {gw_pod_name} are not ready'.format(
-                gw_pod_name=gw_pod_name))
+            LOG.info('Containers in pod %s are not ready', gw_pod_name,
+                     extra=logs.RATE_LIMITED)
             return False
-    LOG.info('Containers in pod {gw_pod_name} are ready'.format(
-        gw_pod_name=gw_pod_name))
+    LOG.info('Containers in pod %s are ready', gw_pod_name,
+             extra=logs.RATE_LIMITED)
     return True
+
+
+def list_pods(kubeconfig_path, kube_namespace):
+    v1 = _core_v1(kubeconfig_path)
+    result = v1.list_namespaced_pod(kube_namespace)
+    LOG.info('Received %d pods from namespace %s',
+             len(result.items), kube_namespace)
+    return result.items
+
+
+def create_lease(kubeconfig_path, kube_namespace, lease_name, labels,
+                 holder_identity, lease_duration, renew_time):
+    from kubernetes import client
+
+    coordination_v1 = _coordination_v1(kubeconfig_path)
+    body = client.V1Lease(
+        metadata=client.V1ObjectMeta(name=lease_name, labels=labels),
+        spec=client.V1LeaseSpec(holder_identity=holder_identity,
+                                lease_duration_seconds=lease_duration,
+                                acquire_time=renew_time,
+                                renew_time=renew_time))
+    LOG.info('Create lease {lease_name} for {holder}'.format(
+        lease_name=lease_name, holder=holder_identity))
+    return coordination_v1.create_namespaced_lease(kube_namespace, body)
+
+
+def renew_lease(kubeconfig_path, kube_namespace, lease_name,
+                holder_identity, lease_duration, renew_time):
+    from kubernetes.client.rest import ApiException
+
+    coordination_v1 = _coordination_v1(kubeconfig_path)
+    body = {'spec': {'holderIdentity': holder_identity,
+                     'leaseDurationSeconds': lease_duration,
+                     'renewTime': renew_time.strftime(K8S_MICRO_TIME_FORMAT)}}
+    try:
+        return coordination_v1.patch_namespaced_lease(lease_name,
+                                                      kube_namespace, body)
+    except ApiException as e:
+        if e.status == 404:
+            return None
+        raise
+
+
+def delete_lease(kubeconfig_path, kube_namespace, lease_name):
+    coordination_v1 = _coordination_v1(kubeconfig_path)
+    LOG.info('Delete lease {lease_name}'.format(lease_name=lease_name))
+    coordination_v1.delete_namespaced_lease(lease_name, kube_namespace)
+
+
+def list_leases(kubeconfig_path, kube_namespace, label_selector):
+    coordination_v1 = _coordination_v1(kubeconfig_path)
+    result = coordination_v1.list_namespaced_lease(
+        kube_namespace, label_selector=label_selector)
+    return result.items
@@ -0,0 +1,111 @@
+# Copyright 2019 Mirantis Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import logging
+import threading
+import time
+
+DEFAULT_LEVEL = 'INFO'
+DEFAULT_FORMAT = 'text'
+TEXT_FORMAT = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
+
+# Messages of the polling paths are logged with extra=RATE_LIMITED and
+# every such message is let through at most burst times per period. Other
+# messages are never limited. Messages are told apart by logger, level and
+# the unformatted message, so a lazily formatted call site is one key
+# whatever its arguments are.
+RATE_LIMITED = {'rate_limited': True}
+DEFAULT_RATE_LIMIT_PERIOD = 60
+DEFAULT_RATE_LIMIT_BURST = 10
+# messages formatted before logging are unique keys, expired ones are
+# dropped when there are too many
+MAX_RATE_LIMIT_KEYS = 10000
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, period=DEFAULT_RATE_LIMIT_PERIOD,
+                 burst=DEFAULT_RATE_LIMIT_BURST):
+        super().__init__()
+        self.period = period
+        self.burst = burst
+        # key -> [window start, messages passed, messages suppressed]
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        # warnings and errors are never dropped
+        if self.burst <= 0 or record.levelno >= logging.WARNING or \
+           not getattr(record, 'rate_limited', False):
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            if len(self._windows) >= MAX_RATE_LIMIT_KEYS:
+                self._prune(now)
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                suppressed = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.msg = '{msg} ({count} similar messages suppressed)'.format(
+                msg=record.msg, count=suppressed)
+        return True
+
+    def _prune(self, now):
+        self._windows = {key: window
+                         for key, window in self._windows.items()
+                         if now - window[0] < self.period}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data)
+
+
+def setup_logging(log_conf=None, level=None):
+    # level given in the command line overrides the config file
+    log_conf = log_conf or {}
+    level = level or log_conf.get('level', DEFAULT_LEVEL)
+
+    handler = logging.StreamHandler()
+    if log_conf.get('format', DEFAULT_FORMAT) == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    rate_limit = log_conf.get('rate_limit') or {}
+    handler.addFilter(RateLimitFilter(
+        period=rate_limit.get('period', DEFAULT_RATE_LIMIT_PERIOD),
+        burst=rate_limit.get('burst', DEFAULT_RATE_LIMIT_BURST)))
+
+    root = logging.getLogger()
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
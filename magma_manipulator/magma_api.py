@@ -14,25 +14,208 @@
 
 import json
 import logging
-import requests
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+import threading
+import time
 from urllib.parse import urljoin
 
+from magma_manipulator.config_parser import cfg as CONF
+from magma_manipulator import cache
 from magma_manipulator import exceptions
+from magma_manipulator import json_codec
+from magma_manipulator import logs
+from magma_manipulator import ratelimit
+from magma_manipulator import resilience
 
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 LOG = logging.getLogger(__name__)
 
+_requests_module = None
+
+
+def _requests():
+    # requests is imported on first use to keep startup of the tool cheap
+    global _requests_module
+    if _requests_module is None:
+        import requests
+        from requests.packages.urllib3.exceptions import \
+            InsecureRequestWarning
+        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+        _requests_module = requests
+    return _requests_module
+
+
+_session_obj = None
+
+
+def _session():
+    # a single session keeps one connection pool to orc8r for the whole
+    # process, whatever the number of watched clusters
+    global _session_obj
+    if _session_obj is None:
+        _session_obj = _requests().Session()
+    return _session_obj
+
+
+_limiter_obj = None
+_limiter_lock = threading.Lock()
+
+
+def _limiter():
+    # one limiter for all orc8r traffic of the process
+    global _limiter_obj
+    with _limiter_lock:
+        if _limiter_obj is None:
+            _limiter_obj = ratelimit.from_config(CONF.get('orc8r_limits'))
+        return _limiter_obj
+
+
+_resilience_obj = None
+_resilience_lock = threading.Lock()
+
+
+def _resilience():
+    global _resilience_obj
+    with _resilience_lock:
+        if _resilience_obj is None:
+            _resilience_obj = resilience.from_config(
+                CONF.get('orc8r_resilience'))
+        return _resilience_obj
+
+
+def _send(method, url, priority, **kwargs):
+    limiter = _limiter()
+    limiter.acquire(priority)
+    start = time.monotonic()
+    failed = True
+    try:
+        resp = _session().request(method, url, verify=False, **kwargs)
+        failed = resp.status_code >= 500
+        return resp
+    finally:
+        limiter.release(time.monotonic() - start, failed)
+
+
+def _request(method, url, endpoint, priority, **kwargs):
+    policy = _resilience()
+    breaker = policy.get_breaker(method, endpoint)
+    retries = policy.get_retries(method)
+    backoff = policy.backoff()
+    transient_errors = (_requests().exceptions.ConnectionError,
+                        _requests().exceptions.Timeout)
+    attempt = 0
+    while True:
+        breaker.check()
+        try:
+            resp = _send(method, url, priority,
+                         timeout=policy.timeout, **kwargs)
+        except transient_errors as e:
+            breaker.record_failure()
+            if attempt >= retries:
+                raise exceptions.MagmaRequestException(
+                    '{method} {url} failed: {err}'.format(
+                        method=method, url=url, err=e))
+            reason = e
+        except _requests().exceptions.RequestException as e:
+            # not retried, but a half-open circuit must not wait for its
+            # trial request forever
+            breaker.record_failure()
+            raise exceptions.MagmaRequestException(
+                '{method} {url} failed: {err}'.format(
+                    method=method, url=url, err=e))
+        else:
+            if resp.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if resp.status_code not in resilience.RETRY_STATUS_CODES or \
+               attempt >= retries:
+                return resp
+            reason = 'status code {code}'.format(code=resp.status_code)
+        attempt += 1
+        delay = next(backoff)
+        LOG.warning('{method} {url} failed with {reason}, retry {attempt} '
+                    'of {retries} in {delay:.1f}s'.format(
+                        method=method, url=url, reason=reason,
+                        attempt=attempt, retries=retries, delay=delay))
+        time.sleep(delay)
+
+
+_cache_obj = None
+_cache_lock = threading.Lock()
+
+
+def _cache():
+    global _cache_obj
+    with _cache_lock:
+        if _cache_obj is None:
+            cache_conf = CONF.get('orc8r_cache') or {}
+            ttls = cache_conf.get('ttl')
+            _cache_obj = cache.ResponseCache(
+                vars(ttls) if ttls else None,
+                cache_conf.get('max_streamed_items',
+                               cache.DEFAULT_MAX_STREAMED_ITEMS))
+        return _cache_obj
+
+
+def get_cache_stats():
+    return _cache().get_stats()
+
+
+class _LazyKeys(object):
+    # top level keys of a response, listed only if the record is emitted
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        if isinstance(self.data, dict):
+            return ', '.join(sorted(str(key) for key in self.data))
+        return type(self.data).__name__
+
+
+def _get_json(url, endpoint, priority, headers, certs):
+    # GET through the response cache. Stale entries are revalidated with
+    # If-None-Match/If-Modified-Since when orc8r sent validators.
+    resp_cache = _cache()
+    entry, fresh = resp_cache.lookup(url, endpoint)
+    if fresh:
+        return entry.data
+
+    req_headers = dict(headers)
+    if entry is not None:
+        req_headers.update(entry.get_validators())
+    resp = _request('GET', url, endpoint, priority,
+                    headers=req_headers,
+                    cert=certs)
+    if resp.status_code == 304 and entry is not None:
+        resp_cache.revalidated(url, entry)
+        return entry.data
+    if resp.status_code != 200:
+        # error bodies of a degraded orc8r are not always JSON
+        raise exceptions.MagmaRequestException(
+            'Received status code {status_code} from {url}'.format(
+                status_code=resp.status_code, url=url))
+
+    data = json_codec.loads(resp.content)
+    resp_cache.store(url, endpoint, data, resp.headers)
+    return data
+
 
 def is_network_exist(orc8r_api_url, gw_net, certs):
-    LOG.info('Check if network {gw_net} exists'.format(gw_net=gw_net))
+    LOG.info('Check if network %s exists', gw_net)
     magma_net_url = urljoin(orc8r_api_url,
                             'magma/v1/networks/{gw_net}'.format(gw_net=gw_net))
-    LOG.debug('Make get request to {url}'.format(url=magma_net_url))
-    resp = requests.get(magma_net_url, verify=False, cert=certs)
-    str_result = resp.content.decode('ascii')
-    json_result = json.loads(str_result)
-    LOG.debug('Received result {result}'.format(result=json_result))
+    LOG.debug('Make get request to %s', magma_net_url)
+    resp = _request('GET', magma_net_url, 'network',
+                    ratelimit.PRIORITY_CHECK, cert=certs)
+    if resp.status_code == 404:
+        return False
+    if resp.status_code != 200:
+        raise exceptions.MagmaRequestException(
+            'Received status code {status_code} while checking network '
+            '{gw_net}'.format(status_code=resp.status_code, gw_net=gw_net))
+    json_result = json_codec.loads(resp.content)
+    LOG.debug('Received network %s', json_result.get('id'))
     if 'id' in json_result:
         return json_result['id'] == gw_net
     return False
@@ -55,17 +238,18 @@ def create_network(orc8r_api_url, gw_net, certs):
 
     headers = {'content-type': 'application/json',
                'accept': 'application/json'}
-    resp = requests.post(magma_net_url,
-                         data=json.dumps(data),
-                         headers=headers,
-                         verify=False,
-                         cert=certs)
+    resp = _request('POST', magma_net_url, 'networks',
+                    ratelimit.PRIORITY_REGISTRATION,
+                    data=json.dumps(data),
+                    headers=headers,
+                    cert=certs)
     msg = 'Receive response {text} with status code '\
           '{status_code} afte network {gw_net} creation.'.format(
                   text=resp.text,
                   status_code=resp.status_code,
                   gw_net=gw_net)
     LOG.info(msg)
+    _cache().invalidate(magma_net_url)
     if resp.status_code not in [200, 201, 204]:
         raise exceptions.MagmaRequestException(msg)
 
@@ -275,29 +459,78 @@ def _get_register_gateway_data(gw_net_type, gw_id, gw_uuid, gw_key, gw_name):
         return data
 
 
-def _apply_gateway_config(orc8r_api_url, net_id, net_type, gw_id, cfg, certs):
+def _diff_config(current, desired, path=''):
+    # Returns dotted paths of the values that differ between two configs
+    if isinstance(current, dict) and isinstance(desired, dict):
+        diff = []
+        for key in sorted(set(current) | set(desired), key=str):
+            key_path = '{path}.{key}'.format(path=path, key=key) \
+                if path else str(key)
+            if key not in current or key not in desired:
+                diff.append(key_path)
+            else:
+                diff.extend(_diff_config(current[key], desired[key],
+                                         key_path))
+        return diff
+    if current != desired:
+        return [path or '.']
+    return []
+
+
+def _get_gw_config_section(net_type):
+    if net_type == 'carrier_wifi_network':
+        return 'carrier_wifi'
+    elif net_type == 'feg':
+        return 'federation'
+
+
+def _apply_gateway_config(orc8r_api_url, net_id, net_type, gw_id, cfg,
+                          current, certs):
+    # current is the config the gateway was just created with. orc8r has
+    # no endpoints below carrier_wifi and federation, so the config is
+    # either skipped as a whole or sent as a whole.
     LOG.info('Apply config to gateway {gw_id} in {net_type} {net_id}'.format(
         gw_id=gw_id, net_type=net_type, net_id=net_id))
+    diff = _diff_config(current, cfg)
+    if not diff:
+        LOG.info('Config of gateway {gw_id} is up to date in '
+                 'orc8r'.format(gw_id=gw_id))
+        return
+    LOG.info('Config of gateway {gw_id} differs in {diff}'.format(
+        gw_id=gw_id, diff=', '.join(diff)))
+
     gw_cfg_url = _get_gw_config_url(net_id, net_type, gw_id)
     magma_gw_cfg_url = urljoin(orc8r_api_url, gw_cfg_url)
-
     headers = {'content-type': 'application/json',
                'accept': 'application/json'}
-    resp = requests.put(magma_gw_cfg_url,
-                        data=json.dumps(cfg),
-                        headers=headers,
-                        verify=False,
-                        cert=certs)
+
+    resp = _request('PUT', magma_gw_cfg_url, 'gateway_config',
+                    ratelimit.PRIORITY_REGISTRATION,
+                    data=json.dumps(cfg),
+                    headers=headers,
+                    cert=certs)
     msg = 'Received response {text} with status code {status_code} after '\
           'applying the configuration to gateway {gw_id}'.format(
               text=resp.text,
               status_code=resp.status_code,
               gw_id=gw_id)
     LOG.info(msg)
+    _cache().invalidate(magma_gw_cfg_url)
     if resp.status_code not in [200, 201, 204]:
         raise exceptions.MagmaRequestException(msg)
 
 
+def _invalidate_gateways(orc8r_api_url, gw_net, gw_net_type):
+    # drops cached gateway listings and configs of the network
+    resp_cache = _cache()
+    resp_cache.invalidate(
+        urljoin(orc8r_api_url, _get_gws_url(gw_net, gw_net_type)),
+        prefix=True)
+    resp_cache.invalidate(
+        urljoin(orc8r_api_url,
+                'magma/v1/networks/{gw_net}/gateways'.format(gw_net=gw_net)))
+
+
 def register_gateway(orc8r_api_url, gw_net, gw_net_type,
                      gw_id, gw_uuid, gw_key, gw_name, gw_conf, certs):
     msg = 'Register gateway {gw_name} with {gw_id} in network {gw_net_type} '\
@@ -319,41 +552,39 @@ def register_gateway(orc8r_api_url, gw_net, gw_net_type,
 
     headers = {'content-type': 'application/json',
                'accept': 'application/json'}
-    resp = requests.post(magma_gw_url,
-                         data=json.dumps(data),
-                         headers=headers,
-                         verify=False,
-                         cert=certs)
+    resp = _request('POST', magma_gw_url, 'gateways',
+                    ratelimit.PRIORITY_REGISTRATION,
+                    data=json.dumps(data),
+                    headers=headers,
+                    cert=certs)
     msg = 'Receive response {text} with status code {status_code} '\
           'after {gw_name} creation'\
           .format(text=resp.text,
                   status_code=resp.status_code,
                   gw_name=gw_name)
     LOG.info(msg)
+    _invalidate_gateways(orc8r_api_url, gw_net, gw_net_type)
 
     if resp.status_code not in [200, 201, 204]:
         raise exceptions.MagmaRequestException(msg)
 
     _apply_gateway_config(orc8r_api_url, gw_net, gw_net_type,
-                          gw_id, gw_conf, certs)
+                          gw_id, gw_conf,
+                          data.get(_get_gw_config_section(gw_net_type)),
+                          certs)
 
 
 def is_gateway_in_network(orc8r_api_url, gw_net, gw_id, certs):
-    LOG.info('Check if gateway {gw_id} exists in network {gw_net}'.format(
-        gw_id=gw_id, gw_net=gw_net))
+    LOG.info('Check if gateway %s exists in network %s', gw_id, gw_net)
     magma_gw_url = urljoin(
         orc8r_api_url,
         'magma/v1/networks/{gw_net}/gateways'.format(
             gw_net=gw_net))
     headers = {'content-type': 'application/json',
                'accept': 'application/json'}
-    resp = requests.get(magma_gw_url,
-                        headers=headers,
-                        verify=False,
-                        cert=certs)
-    data = json.loads(resp.content.decode('ascii'))
-    LOG.info('Gateways {gws} presented in network {gw_net}'.format(
-        gws=data, gw_net=gw_net))
+    data = _get_json(magma_gw_url, 'network_gateways',
+                     ratelimit.PRIORITY_CHECK, headers, certs)
+    LOG.info('%d gateways presented in network %s', len(data), gw_net)
     return gw_id in data
 
 
@@ -377,22 +608,24 @@ def delete_gateway(orc8r_api_url, gw_net, gw_net_type, gw_id, certs):
 
     headers = {'content-type': 'application/json',
                'accept': 'application/json'}
-    resp = requests.delete(magma_gw_url,
-                           headers=headers,
-                           verify=False,
-                           cert=certs)
+    resp = _request('DELETE', magma_gw_url, 'gateway',
+                    ratelimit.PRIORITY_REGISTRATION,
+                    headers=headers,
+                    cert=certs)
     msg = 'Received response {text} with status code {status_code} '\
           'after gateway {gw_id} deletion'\
           .format(text=resp.text,
                   status_code=resp.status_code,
                   gw_id=gw_id)
     LOG.info(msg)
-    if resp.status_code not in [200, 201, 204]:
+    _invalidate_gateways(orc8r_api_url, gw_net, gw_net_type)
+    # a DELETE retried after a gateway timeout finds the gateway gone
+    if resp.status_code not in [200, 201, 204, 404]:
         raise exceptions.MagmaRequestException(msg)
 
 
 def get_networks(orc8r_api_url, certs):
-    LOG.info('Get all networks from Magma')
+    LOG.info('Get all networks from Magma', extra=logs.RATE_LIMITED)
     magma_nets_url = urljoin(
         orc8r_api_url,
         'magma/v1/networks')
@@ -400,18 +633,16 @@ def get_networks(orc8r_api_url, certs):
     headers = {'content-type': 'application/json',
                'accept': 'application/json'}
 
-    resp = requests.get(magma_nets_url,
-                        headers=headers,
-                        verify=False,
-                        cert=certs)
-    data = json.loads(resp.content.decode('ascii'))
-    LOG.info('Received networks {nets} from Magma'.format(
-        nets=data))
+    data = _get_json(magma_nets_url, 'networks',
+                     ratelimit.PRIORITY_POLLING, headers, certs)
+    LOG.info('Received %d networks from Magma', len(data),
+             extra=logs.RATE_LIMITED)
+    LOG.debug('Networks in Magma %s', data)
     return data
 
 
 def get_network_type(orc8r_api_url, net_id, certs):
-    LOG.info('Get type for network {net_id}'.format(net_id=net_id))
+    LOG.info('Get type for network %s', net_id, extra=logs.RATE_LIMITED)
     magma_net_type_url = urljoin(
         orc8r_api_url,
         'magma/v1/networks/{net_id}/type'.format(net_id=net_id))
@@ -419,14 +650,9 @@ def get_network_type(orc8r_api_url, net_id, certs):
     headers = {'content-type': 'application/json',
                'accept': 'application/json'}
 
-    resp = requests.get(magma_net_type_url,
-                        headers=headers,
-                        verify=False,
-                        cert=certs)
-
-    data = json.loads(resp.content.decode('ascii'))
-    LOG.info('Type of network {net_id} is {net_type}'.format(
-       net_id=net_id, net_type=data))
+    data = _get_json(magma_net_type_url, 'network_type',
+                     ratelimit.PRIORITY_POLLING, headers, certs)
+    LOG.info('Type of network %s is %s', net_id, data, extra=logs.RATE_LIMITED)
     return data
 
 
@@ -439,8 +665,8 @@ def _get_gws_url(net_id, net_type):
 
 
 def get_gateways(orc8r_api_url, net_id, net_type, certs):
-    LOG.info('Get all gateways from {net_id} {net_type}'.format(
-        net_id=net_id, net_type=net_type))
+    LOG.info('Get all gateways from %s %s', net_id, net_type,
+             extra=logs.RATE_LIMITED)
     gws_url = _get_gws_url(net_id, net_type)
     magma_gws_url = urljoin(
         orc8r_api_url,
@@ -449,19 +675,75 @@ def get_gateways(orc8r_api_url, net_id, net_type, certs):
     headers = {'content-type': 'application/json',
                'accept': 'application/json'}
 
-    resp = requests.get(magma_gws_url,
-                        headers=headers,
-                        verify=False,
-                        cert=certs)
-
-    data = json.loads(resp.content.decode('ascii'))
-    LOG.info('Received gateways {gws} from network {net_id}'.format(
-        gws=list(data.keys()), net_id=net_id))
-    LOG.debug('Gateways in network {net_id} {gws}'.format(
-        net_id=net_id, gws=data))
+    data = _get_json(magma_gws_url, 'gateways',
+                     ratelimit.PRIORITY_POLLING, headers, certs)
+    LOG.info('Received %d gateways from network %s', len(data), net_id,
+             extra=logs.RATE_LIMITED)
     return data
 
 
+def iter_gateways(orc8r_api_url, net_id, net_type, certs):
+    # Same as get_gateways but yields (gw_id, gw_desc) pairs while the
+    # response is being read. Only listings small enough to be cached are
+    # collected, so big networks are never held in memory as a whole.
+    LOG.info('Iterate over gateways from %s %s', net_id, net_type,
+             extra=logs.RATE_LIMITED)
+    gws_url = _get_gws_url(net_id, net_type)
+    magma_gws_url = urljoin(
+        orc8r_api_url,
+        gws_url)
+
+    headers = {'content-type': 'application/json',
+               'accept': 'application/json'}
+
+    resp_cache = _cache()
+    entry, fresh = resp_cache.lookup(magma_gws_url, 'gateways')
+    if fresh:
+        yield from entry.data.items()
+        return
+
+    req_headers = dict(headers)
+    if entry is not None:
+        req_headers.update(entry.get_validators())
+    resp = _request('GET', magma_gws_url, 'gateways',
+                    ratelimit.PRIORITY_POLLING,
+                    headers=req_headers,
+                    cert=certs,
+                    stream=True)
+    try:
+        if resp.status_code == 304 and entry is not None:
+            resp_cache.revalidated(magma_gws_url, entry)
+            yield from entry.data.items()
+            return
+        if resp.status_code not in [200]:
+            msg = 'Received status code {status_code} while listing '\
+                  'gateways of network {net_id}'.format(
+                      status_code=resp.status_code, net_id=net_id)
+            LOG.error(msg)
+            raise exceptions.MagmaRequestException(msg)
+        resp.raw.decode_content = True
+        # the listing is only collected when it is going to be cached
+        collected = {} if resp_cache.wants('gateways', resp.headers) \
+            else None
+        count = 0
+        for gw_id, gw_desc in json_codec.iter_items(resp.raw):
+            count += 1
+            if collected is not None:
+                if count > resp_cache.max_streamed_items:
+                    # too big to cache, it is streamed again next time
+                    collected = None
+                else:
+                    collected[gw_id] = gw_desc
+            yield gw_id, gw_desc
+        if collected is not None:
+            resp_cache.store(magma_gws_url, 'gateways', collected,
+                             resp.headers)
+        LOG.info('Received %d gateways from network %s', count, net_id,
+                 extra=logs.RATE_LIMITED)
+    finally:
+        resp.close()
+
+
 def _get_gw_config_url(net_id, net_type, gw_id):
     if net_type == 'carrier_wifi_network':
         url = 'magma/v1/cwf/{net_id}/gateways/{gw_id}/carrier_wifi'.format(
@@ -473,23 +755,17 @@ def _get_gw_config_url(net_id, net_type, gw_id):
 
 
 def get_gateway_config(orc8r_api_url, net_id, net_type, gw_id, certs):
-    LOG.info('Get config for gateway {gw_id} in {net_type} {net_id}'.format(
-        gw_id=gw_id, net_type=net_type, net_id=net_id))
+    LOG.info('Get config for gateway %s in %s %s', gw_id, net_type, net_id,
+             extra=logs.RATE_LIMITED)
     gw_cfg_url = _get_gw_config_url(net_id, net_type, gw_id)
     magma_gw_cfg_url = urljoin(orc8r_api_url, gw_cfg_url)
 
     headers = {'content-type': 'application/json',
                'accept': 'application/json'}
 
-    resp = requests.get(magma_gw_cfg_url,
-                        headers=headers,
-                        verify=False,
-                        cert=certs)
-
-    data = json.loads(resp.content.decode('ascii'))
-    LOG.info('Received config for gateway {gw_id} '
-             'from network {net_id} {net_type}'.format(
-                gw_id=gw_id, net_id=net_id, net_type=net_type))
-    LOG.debug('Config for cateway {gw_id} {cfg}'.format(
-        gw_id=gw_id, cfg=data))
+    data = _get_json(magma_gw_cfg_url, 'gateway_config',
+                     ratelimit.PRIORITY_POLLING, headers, certs)
+    LOG.info('Received config for gateway %s from network %s %s with '
+             'sections %s', gw_id, net_id, net_type, _LazyKeys(data),
+             extra=logs.RATE_LIMITED)
     return data
@@ -14,99 +14,187 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import argparse
+from concurrent import futures
 import logging
 import threading
 import time
 from queue import Queue
 
-from kubernetes import client, config, watch
-
 from magma_manipulator.config_parser import cfg as CONF
+from magma_manipulator import config_parser
 from magma_manipulator import gateways
 from magma_manipulator import k8s_tools
+from magma_manipulator import exceptions
+from magma_manipulator import fleet
+from magma_manipulator import logs
 from magma_manipulator import magma_api
+from magma_manipulator import reconcile
+from magma_manipulator import registration
+from magma_manipulator import sharding
 from magma_manipulator import utils
 
 
 LOG = logging.getLogger(__name__)
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
 
 GWS_CFG_PULL_INTERVAL = 30
+GWS_INVENTORY_REFRESH_INTERVAL = 300
 RETRY_ON_FAIL = 3
 
 K8S_STARTED_REASON = ('Started',)
+# events that come before the container is started
+K8S_PREWARM_REASONS = ('Scheduled', 'Pulling', 'Pulled', 'Created')
 K8S_ADDED_TYPE = ('ADDED',)
+PREWARM_WORKERS = 4
+
+prewarm_pool = futures.ThreadPoolExecutor(max_workers=PREWARM_WORKERS)
 
 events_queue = Queue()
 INIT_QUEUE_TIMEOUT = 10
 EVENT_MAX_TIMEOUT = 900
 
 
-def watch_for_gateways(kubeconfig_path, kube_namespace, gw_names):
-    config.load_kube_config(config_file=kubeconfig_path)
-    v1 = client.CoreV1Api()
-    w = watch.Watch()
+def watch_for_gateways(target, gws_manager, shard):
     # infinity loop for k8s events
-    for event in w.stream(v1.list_namespaced_event,
-                          kube_namespace, timeout_seconds=0):
-        pod_name_prefix = event['object'].involved_object.name.split('-')[0]
-        if pod_name_prefix in gw_names:
+    for event in k8s_tools.watch_events(target.kubeconfig_path,
+                                        target.namespace):
+        gw = gws_manager.find_gateway(event['object'].involved_object.name)
+        if gw is not None and shard.owns(gw.name):
             if event['type'] in K8S_ADDED_TYPE and \
-               event['object'].reason in K8S_STARTED_REASON:
-                LOG.info('Received event from k8s: {type} {name} {reason} '
-                         '{timestamp} {msg}'.format(
-                             type=event['type'],
-                             name=event['object'].involved_object.name,
-                             reason=event['object'].reason,
-                             timestamp=event['object'].first_timestamp,
-                             msg=event['object'].message))
+               event['object'].reason in K8S_PREWARM_REASONS:
+                LOG.debug('Received %s event for %s',
+                          event['object'].reason,
+                          event['object'].involved_object.name,
+                          extra=logs.RATE_LIMITED)
+                if gw.claim_prewarm(event['object'].involved_object.uid):
+                    prewarm_pool.submit(gw.prewarm,
+                                        event['object'].involved_object.name,
+                                        event['object'].involved_object.uid,
+                                        target)
+            elif event['type'] in K8S_ADDED_TYPE and \
+                    event['object'].reason in K8S_STARTED_REASON:
+                LOG.info('Received event from k8s %s: %s %s %s %s %s',
+                         target.namespace,
+                         event['type'],
+                         event['object'].involved_object.name,
+                         event['object'].reason,
+                         event['object'].first_timestamp,
+                         event['object'].message)
                 event = {
                     'pod_name': event['object'].involved_object.name,
+                    'pod_uid': event['object'].involved_object.uid,
+                    'target': target,
                     'timeout': INIT_QUEUE_TIMEOUT,
                     'retry_on_fail': RETRY_ON_FAIL
                 }
                 events_queue.put(event)
 
 
-def pull_gws_configs(gateways):
+def pull_gws_configs(gws_manager, shard):
     while True:
-        for gw_name, gw in gateways.items():
-            gw_config = magma_api.get_gateway_config(
-                CONF.orc8r_api_url,
-                gw.network, gw.network_type,
-                gw.id, CONF.magma_certs_path)
+        for gw_name, gw in gws_manager.get_gateways().items():
+            if not shard.owns(gw_name):
+                continue
+            try:
+                gw_config = magma_api.get_gateway_config(
+                    CONF.orc8r_api_url,
+                    gw.network, gw.network_type,
+                    gw.id, CONF.magma_certs_path)
+            except exceptions.MagmaRequestException as e:
+                LOG.error('Can not pull config for {gw_name}: {err}'.format(
+                    gw_name=gw.name, err=e))
+                continue
 
             config_path = utils.save_gateway_config(
                 gw.id, CONF.gateways.configs_dir, gw_config)
             gw.config_path = config_path
-            LOG.info('Pulled config for {gw_name} {gw_id}'.format(
-                gw_name=gw.name, gw_id=gw.id))
+            LOG.info('Pulled config for %s %s', gw.name, gw.id)
         time.sleep(GWS_CFG_PULL_INTERVAL)
 
 
-def start_periodic_tasks(gateways):
-    LOG.info('Start watching for k8s events from gateways {gws}'.format(
-        gws=(gateways.keys())))
-    watch_thread = threading.Thread(
-        target=watch_for_gateways,
-        args=(CONF.k8s.kubeconfig_path,
-              CONF.k8s.namespace,
-              gateways.keys()))
-    watch_thread.start()
+def refresh_gws_inventory(gws_manager, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            gws_manager.refresh()
+        except Exception as e:
+            LOG.error('Can not refresh gateways inventory: {err}'.format(
+                err=e))
+        # e.g. connections prewarmed for pods that never started
+        utils.close_idle_ssh_connections()
+        LOG.info('orc8r response cache statistics: %s',
+                 magma_api.get_cache_stats())
+        LOG.info('Gateway pods identity cache statistics: %s',
+                 gateways.get_identity_cache_stats())
+
+
+def reconcile_gws(gws_manager, shard, interval):
+    targets = k8s_tools.get_targets(CONF.k8s)
+    while True:
+        time.sleep(interval)
+        try:
+            diverged = reconcile.find_diverged_gateways(gws_manager,
+                                                        targets, shard)
+        except Exception as e:
+            LOG.error('Can not reconcile gateways with orc8r: {err}'.format(
+                err=e))
+            continue
+        for gw, pod, target, reason in diverged:
+            LOG.warning('Gateway {gw_name} {gw_id} in pod {pod_name} needs '
+                        'registration: {reason}'.format(
+                            gw_name=gw.name, gw_id=gw.id,
+                            pod_name=pod.metadata.name, reason=reason))
+            events_queue.put({
+                'pod_name': pod.metadata.name,
+                'pod_uid': pod.metadata.uid,
+                'target': target,
+                'timeout': INIT_QUEUE_TIMEOUT,
+                'retry_on_fail': RETRY_ON_FAIL
+            })
+
+
+def start_periodic_tasks(gws_manager, shard):
+    # all watchers feed the same events queue and gateways inventory
+    for target in k8s_tools.get_targets(CONF.k8s):
+        LOG.info('Start watching for k8s events in namespace {ns} of '
+                 '{kubeconfig} from gateways {gws}'.format(
+                     ns=target.namespace,
+                     kubeconfig=target.kubeconfig_path,
+                     gws=gws_manager.get_gateway_names()))
+        watch_thread = threading.Thread(
+            target=watch_for_gateways,
+            args=(target, gws_manager, shard))
+        watch_thread.start()
+
+    refresh_interval = CONF.gateways.get('refresh_interval',
+                                         GWS_INVENTORY_REFRESH_INTERVAL)
+    LOG.info('Refreshing gateways inventory at {interval} second '
+             'interval'.format(interval=refresh_interval))
+    refresh_thread = threading.Thread(
+        target=refresh_gws_inventory,
+        args=(gws_manager, refresh_interval))
+    refresh_thread.start()
+
+    reconcile_interval = CONF.gateways.get('reconcile_interval',
+                                           reconcile.GWS_RECONCILE_INTERVAL)
+    LOG.info('Reconciling gateway pods with orc8r at {interval} second '
+             'interval'.format(interval=reconcile_interval))
+    reconcile_thread = threading.Thread(
+        target=reconcile_gws,
+        args=(gws_manager, shard, reconcile_interval))
+    reconcile_thread.start()
 
     LOG.info('Pulling gateways config at {interval} second interval'.format(
         interval=GWS_CFG_PULL_INTERVAL))
     cfg_puller_thread = threading.Thread(
         target=pull_gws_configs,
-        args=(gateways,))
+        args=(gws_manager, shard))
     cfg_puller_thread.start()
 
 
 def put_event_after_timeout(event):
-    LOG.debug('Wait {sec} seconds for event {event}'.format(
-        sec=event['timeout'], event=event['pod_name']))
+    LOG.debug('Wait %s seconds for event %s',
+              event['timeout'], event['pod_name'], extra=logs.RATE_LIMITED)
     if event['timeout'] > EVENT_MAX_TIMEOUT:
         LOG.error('Can not handle event for pod {pod_name}. Timeout expired'
                   .format(pod_name=event['pod_name']))
@@ -115,64 +203,89 @@ def put_event_after_timeout(event):
     t.start()
 
 
-def main():
-    gws_manager = gateways.GatewaysManager()
-    start_periodic_tasks(gws_manager.get_gateways())
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='magma-manipulator',
+        description='Automatically re-register Magma gateways running '
+                    'in Kubernetes')
+    parser.add_argument(
+        '--config-file',
+        help='Path to the configuration file. Can also be set with the '
+             '{env} environment variable'.format(
+                 env=config_parser.CONFIG_ENV_VAR))
+    parser.add_argument(
+        '--log-level',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+        type=str.upper,
+        help='Logging level. Overrides logging.level of the configuration '
+             'file (default: {default})'.format(default=logs.DEFAULT_LEVEL))
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser(
+        'run',
+        help='Watch for gateway pods and re-register them when they are '
+             'recreated (default)')
+    fleet.add_register_parser(subparsers)
+    fleet.add_audit_parser(subparsers)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.config_file:
+        config_parser.set_config_path(args.config_file)
+    logs.setup_logging(CONF.get('logging'), args.log_level)
+
+    if args.command == 'register':
+        return fleet.register_fleet(args)
+    if args.command == 'audit':
+        return fleet.audit_fleet(args)
+    run()
+
+
+def run():
+    shard = sharding.get_shard(CONF)
+    shard.start()
+    gws_manager = gateways.GatewaysManager(shard)
+
+    def log_owned_gateways(members):
+        LOG.info('Replica {replica} owns gateways {gws} of {count} '
+                 'replicas'.format(
+                     replica=shard.replica_id,
+                     gws=[name for name in gws_manager.get_gateway_names()
+                          if shard.owns(name)],
+                     count=len(members)))
+    shard.add_listener(log_owned_gateways)
+
+    start_periodic_tasks(gws_manager, shard)
 
     while True:
         try:
             if not events_queue.empty():
                 event = events_queue.get()
                 gw_pod_name = event['pod_name']
-                gw = gws_manager.get_gateway(gw_pod_name)
-
-                LOG.info('Handle event for {gw_pod_name}'.format(
-                    gw_pod_name=gw_pod_name))
-
-                if not k8s_tools.is_pod_ready(CONF.k8s.kubeconfig_path,
-                                              CONF.k8s.namespace,
-                                              gw_pod_name):
-                    event['timeout'] *= 2
-                    put_event_after_timeout(event)
+                target = event['target']
+                gw = gws_manager.find_gateway(gw_pod_name)
+                if gw is None:
+                    # the gateway left the inventory after the event came
+                    LOG.warning('Drop event for %s, no such gateway',
+                                gw_pod_name)
                     continue
 
-                if not utils.is_gw_reachable(gw.get_ip(gw_pod_name)):
-                    event['timeout'] *= 2
-                    put_event_after_timeout(event)
-                    continue
+                LOG.info('Handle event for %s', gw_pod_name)
 
-                if not utils.is_cloud_init_done(
-                        gw.get_ip(gw_pod_name),
-                        CONF.gateways.username,
-                        CONF.gateways.rsa_private_key_path):
+                if not registration.register_gateway(gw, gw_pod_name,
+                                                     event['pod_uid'],
+                                                     target):
                     event['timeout'] *= 2
                     put_event_after_timeout(event)
                     continue
-
-                if magma_api.is_gateway_in_network(CONF.orc8r_api_url,
-                                                   gw.network,
-                                                   gw.id,
-                                                   CONF.magma_certs_path):
-                    magma_api.delete_gateway(CONF.orc8r_api_url,
-                                             gw.network, gw.network_type,
-                                             gw.id, CONF.magma_certs_path)
-
-                # get gw hardware id and challenge key
-                gw_uuid, gw_key = gw.get_uuid_and_key()
-
-                magma_api.register_gateway(CONF.orc8r_api_url,
-                                           gw.network, gw.network_type,
-                                           gw.id, gw_uuid, gw_key,
-                                           gw.name, gw.gwt_config(),
-                                           CONF.magma_certs_path)
             time.sleep(1)
         except Exception as e:
             LOG.error(e)
             if event['retry_on_fail'] > 0:
                 event['retry_on_fail'] -= 1
                 put_event_after_timeout(event)
-                LOG.warning('Try to register gateway {gw_name} {gw_id} one '
+                LOG.warning('Try to register gateway pod {pod_name} one '
                             'more time. Remainig attempts {attempts}'.format(
-                                gw_name=gw.name,
-                                gw_id=gw.id,
+                                pod_name=event['pod_name'],
                                 attempts=event['retry_on_fail']))
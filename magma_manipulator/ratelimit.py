@@ -0,0 +1,138 @@
+# Copyright 2019 Mirantis Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+PRIORITY_REGISTRATION = 0
+PRIORITY_CHECK = 1
+PRIORITY_POLLING = 2
+
+# Share of the current concurrency limit a priority class may occupy, so
+# background polling leaves room for registrations when orc8r is slow.
+PRIORITY_SHARES = {
+    PRIORITY_REGISTRATION: 1.0,
+    PRIORITY_CHECK: 0.8,
+    PRIORITY_POLLING: 0.5,
+}
+
+DEFAULT_RATE = 20
+DEFAULT_BURST = 40
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_LATENCY_TARGET = 2.0
+
+DECREASE_FACTOR = 0.5
+DECREASE_COOLDOWN = 1.0
+
+
+class AdaptiveLimiter(object):
+    # Token bucket for the request rate combined with an AIMD limit on the
+    # number of requests in flight. The limit grows by one per limit-worth of
+    # fast successful responses and is halved (at most once per cooldown)
+    # when a response is slow or failed. Waiters are served in priority order.
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 min_concurrency=DEFAULT_MIN_CONCURRENCY,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 latency_target=DEFAULT_LATENCY_TARGET):
+        self.rate = rate
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._limit = float(max_concurrency)
+        self._in_flight = 0
+        self._decreased_at = 0.0
+        self._waiters = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self):
+        return self._limit
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._refilled_at
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._refilled_at = now
+
+    def _can_start(self, priority):
+        allowed = max(1.0, self._limit * PRIORITY_SHARES[priority])
+        return self._in_flight < allowed and self._tokens >= 1
+
+    def acquire(self, priority=PRIORITY_POLLING):
+        with self._cond:
+            waiter = (priority, next(self._counter))
+            heapq.heappush(self._waiters, waiter)
+            try:
+                while True:
+                    self._refill()
+                    if self._waiters[0] == waiter and \
+                       self._can_start(priority):
+                        break
+                    timeout = None
+                    if self._tokens < 1:
+                        timeout = (1 - self._tokens) / self.rate
+                    self._cond.wait(timeout)
+            except BaseException:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiters)
+            self._tokens -= 1
+            self._in_flight += 1
+            self._cond.notify_all()
+
+    def release(self, latency, failed=False):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if failed or latency > self.latency_target:
+                if now - self._decreased_at >= DECREASE_COOLDOWN:
+                    self._limit = max(self.min_concurrency,
+                                      self._limit * DECREASE_FACTOR)
+                    self._decreased_at = now
+                    LOG.warning('orc8r is degraded (latency {latency:.2f}s, '
+                                'failed {failed}), concurrency limit '
+                                'decreased to {limit:.1f}'.format(
+                                    latency=latency, failed=failed,
+                                    limit=self._limit))
+            else:
+                self._limit = min(self.max_concurrency,
+                                  self._limit + 1.0 / self._limit)
+            self._cond.notify_all()
+
+
+def from_config(limits_conf):
+    if not limits_conf:
+        return AdaptiveLimiter()
+    return AdaptiveLimiter(
+        rate=limits_conf.get('rate', DEFAULT_RATE),
+        burst=limits_conf.get('burst', DEFAULT_BURST),
+        min_concurrency=limits_conf.get('min_concurrency',
+                                        DEFAULT_MIN_CONCURRENCY),
+        max_concurrency=limits_conf.get('max_concurrency',
+                                        DEFAULT_MAX_CONCURRENCY),
+        latency_target=limits_conf.get('latency_target',
+                                       DEFAULT_LATENCY_TARGET))
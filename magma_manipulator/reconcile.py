@@ -0,0 +1,112 @@
+# Copyright 2019 Mirantis Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+# Periodic comparison of gateway pods with orc8r registrations. It catches
+# the pods whose Started event was missed (watch reconnects, restarts of
+# the tool) with one pods listing per k8s target and one gateways listing
+# per network instead of a request per gateway.
+
+import logging
+import time
+
+from magma_manipulator.config_parser import cfg as CONF
+from magma_manipulator import k8s_tools
+from magma_manipulator import magma_api
+
+LOG = logging.getLogger(__name__)
+
+GWS_RECONCILE_INTERVAL = 600
+# seconds a running pod may stay without orc8r checkins
+STALE_CHECKIN_TIMEOUT = 600
+
+REASON_NOT_REGISTERED = 'not registered in orc8r'
+REASON_HARDWARE_ID = 'hardware id differs from orc8r'
+REASON_POD_RECREATED = 'pod was recreated'
+REASON_NO_CHECKIN = 'no checkin from the pod'
+
+
+def _is_pod_ready(pod):
+    # pods which are not ready yet are handled by their Started event
+    if pod.status.phase != 'Running':
+        return False
+    statuses = pod.status.container_statuses or []
+    return bool(statuses) and all(c.ready for c in statuses)
+
+
+def _get_pod_age(pod, now):
+    if pod.status.start_time is None:
+        return 0
+    return now - pod.status.start_time.timestamp()
+
+
+def _get_divergence(gw, pod, gw_desc, now):
+    if gw_desc is None:
+        return REASON_NOT_REGISTERED
+
+    hw_id = (gw_desc.get('device') or {}).get('hardware_id')
+    known_hw_id = gw.get_cached_uuid(pod.metadata.uid)
+    if known_hw_id is not None and known_hw_id != hw_id:
+        return REASON_HARDWARE_ID
+
+    if gw.registered_pod_uid is not None:
+        if gw.registered_pod_uid != pod.metadata.uid:
+            return REASON_POD_RECREATED
+        return None
+
+    # The tool was restarted and does not know which pod was registered.
+    # orc8r accepts checkins only from the registered device, so a checkin
+    # made after the pod started proves the pod is the registered one.
+    checkin_time = (gw_desc.get('status') or {}).get('checkin_time')
+    if checkin_time and pod.status.start_time is not None and \
+       checkin_time / 1000.0 > pod.status.start_time.timestamp():
+        gw.registered_pod_uid = pod.metadata.uid
+        return None
+    if _get_pod_age(pod, now) > STALE_CHECKIN_TIMEOUT:
+        return REASON_NO_CHECKIN
+    # the pod may still be starting, it is checked again next time
+    return None
+
+
+def find_diverged_gateways(gws_manager, targets, shard):
+    # Returns a list of (gw, pod, target, reason) for the owned gateways
+    # whose running pod is not the one registered in orc8r.
+    gw_pods = {}
+    for target in targets:
+        for pod in k8s_tools.list_pods(target.kubeconfig_path,
+                                       target.namespace):
+            gw = gws_manager.find_gateway(pod.metadata.name)
+            if gw is None or not shard.owns(gw.name) or \
+               not _is_pod_ready(pod):
+                continue
+            gw_pods[gw.name] = (gw, pod, target)
+
+    networks = {gw.network: gw.network_type
+                for gw, _, _ in gw_pods.values()}
+    registered = {}
+    for net, net_type in networks.items():
+        registered[net] = dict(magma_api.iter_gateways(
+            CONF.orc8r_api_url, net, net_type, CONF.magma_certs_path))
+
+    now = time.time()
+    diverged = []
+    for gw, pod, target in gw_pods.values():
+        reason = _get_divergence(gw, pod, registered[gw.network].get(gw.id),
+                                 now)
+        if reason is not None:
+            diverged.append((gw, pod, target, reason))
+    LOG.info('Reconciled {count} gateway pods with orc8r in {nets} '
+             'networks, {diverged} diverged'.format(
+                 count=len(gw_pods), nets=len(networks),
+                 diverged=len(diverged)))
+    return diverged
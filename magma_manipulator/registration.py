@@ -0,0 +1,65 @@
+# Copyright 2019 Mirantis Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+
+from magma_manipulator.config_parser import cfg as CONF
+from magma_manipulator import gateways
+from magma_manipulator import k8s_tools
+from magma_manipulator import magma_api
+from magma_manipulator import utils
+
+LOG = logging.getLogger(__name__)
+
+
+def register_gateway(gw, gw_pod_name, gw_pod_uid, target):
+    # Returns False if the pod is not ready to be registered yet and the
+    # caller should try again later.
+    if not k8s_tools.is_pod_ready(target.kubeconfig_path,
+                                  target.namespace,
+                                  gw_pod_name):
+        return False
+
+    if not utils.is_gw_reachable(gw.get_ip(gw_pod_name, gw_pod_uid, target)):
+        return False
+
+    if not utils.is_cloud_init_done(
+            gw.get_ip(gw_pod_name, gw_pod_uid, target),
+            CONF.gateways.username,
+            CONF.gateways.rsa_private_key_path):
+        return False
+
+    try:
+        if gw.is_in_orc8r(max_age=gateways.PREWARM_MAX_AGE):
+            magma_api.delete_gateway(CONF.orc8r_api_url,
+                                     gw.network, gw.network_type,
+                                     gw.id, CONF.magma_certs_path)
+
+        # get gw hardware id and challenge key
+        gw_uuid, gw_key = gw.get_uuid_and_key()
+
+        magma_api.register_gateway(CONF.orc8r_api_url,
+                                   gw.network, gw.network_type,
+                                   gw.id, gw_uuid, gw_key,
+                                   gw.name, gw.get_config(),
+                                   CONF.magma_certs_path)
+    finally:
+        # a failed delete or register may have changed orc8r anyway
+        gw.forget_orc8r_state()
+    utils.close_ssh_connection(gw.get_ip(gw_pod_name, gw_pod_uid, target),
+                               CONF.gateways.username)
+    gw.registered_pod_uid = gw_pod_uid
+    LOG.info('Gateway %s %s registered from pod %s',
+             gw.name, gw.id, gw_pod_name)
+    return True
@@ -0,0 +1,158 @@
+# Copyright 2019 Mirantis Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+import random
+import threading
+import time
+
+from magma_manipulator import exceptions
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_CAP = 10
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+
+# only requests that can be safely repeated are retried
+IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
+RETRY_STATUS_CODES = (502, 503, 504)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half-open'
+
+
+def decorrelated_jitter(base, cap):
+    # "Decorrelated jitter" backoff: every delay is drawn between the base
+    # and three times the previous delay, capped at cap.
+    delay = base
+    while True:
+        delay = min(cap, random.uniform(base, delay * 3))
+        yield delay
+
+
+class CircuitBreaker(object):
+    # Opens after failure_threshold consecutive failures and rejects calls
+    # for reset_timeout seconds, then lets a single trial call through.
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def check(self):
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return
+            if self.state == STATE_OPEN and \
+               time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = STATE_HALF_OPEN
+                self._trial_running = False
+            if self.state == STATE_HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+        raise exceptions.CircuitOpenException(
+            'Circuit for orc8r endpoint {name} is open, request '
+            'rejected'.format(name=self.name))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != STATE_CLOSED:
+                LOG.info('Circuit for orc8r endpoint {name} is closed'
+                         .format(name=self.name))
+            self.state = STATE_CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == STATE_HALF_OPEN or \
+               self._failures >= self.failure_threshold:
+                if self.state != STATE_OPEN:
+                    LOG.warning('Circuit for orc8r endpoint {name} is open '
+                                'after {failures} failures'.format(
+                                    name=self.name,
+                                    failures=self._failures))
+                self.state = STATE_OPEN
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+
+class ResiliencePolicy(object):
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT,
+                 retries=DEFAULT_RETRIES,
+                 backoff_base=DEFAULT_BACKOFF_BASE,
+                 backoff_cap=DEFAULT_BACKOFF_CAP,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get_breaker(self, method, endpoint):
+        # Reads and writes of an endpoint have separate circuits, so failing
+        # background polling does not reject registrations.
+        key = (method, endpoint)
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(
+                    '{method} {endpoint}'.format(method=method,
+                                                 endpoint=endpoint),
+                    self.failure_threshold, self.reset_timeout)
+            return self._breakers[key]
+
+    def get_retries(self, method):
+        if method in IDEMPOTENT_METHODS:
+            return self.retries
+        return 0
+
+    def backoff(self):
+        return decorrelated_jitter(self.backoff_base, self.backoff_cap)
+
+
+def from_config(resilience_conf):
+    if not resilience_conf:
+        return ResiliencePolicy()
+    return ResiliencePolicy(
+        connect_timeout=resilience_conf.get('connect_timeout',
+                                            DEFAULT_CONNECT_TIMEOUT),
+        read_timeout=resilience_conf.get('read_timeout',
+                                         DEFAULT_READ_TIMEOUT),
+        retries=resilience_conf.get('retries', DEFAULT_RETRIES),
+        backoff_base=resilience_conf.get('backoff_base',
+                                         DEFAULT_BACKOFF_BASE),
+        backoff_cap=resilience_conf.get('backoff_cap', DEFAULT_BACKOFF_CAP),
+        failure_threshold=resilience_conf.get('failure_threshold',
+                                              DEFAULT_FAILURE_THRESHOLD),
+        reset_timeout=resilience_conf.get('reset_timeout',
+                                          DEFAULT_RESET_TIMEOUT))
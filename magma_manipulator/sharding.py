@@ -0,0 +1,210 @@
+# Copyright 2019 Mirantis Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+import datetime
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+
+from magma_manipulator import k8s_tools
+
+LOG = logging.getLogger(__name__)
+
+LEASE_LABELS = {'app': 'magma-manipulator-shard'}
+LEASE_NAME_PREFIX = 'magma-manipulator-'
+VIRTUAL_NODES = 64
+DEFAULT_LEASE_DURATION = 30
+DEFAULT_RENEW_INTERVAL = 10
+
+
+def _hash(key):
+    digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+    return int(digest[:16], 16)
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class HashRing(object):
+    def __init__(self, members, virtual_nodes=VIRTUAL_NODES):
+        self.members = frozenset(members)
+        ring = sorted((_hash('{member}#{idx}'.format(member=m, idx=i)), m)
+                      for m in self.members
+                      for i in range(virtual_nodes))
+        self._hashes = [h for h, _ in ring]
+        self._owners = [m for _, m in ring]
+
+    def get_owner(self, key):
+        if not self._hashes:
+            return None
+        idx = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[idx]
+
+
+class SingleReplica(object):
+    # owns every gateway, used when sharding is disabled
+    replica_id = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def owns(self, gw_name):
+        return True
+
+    def add_listener(self, callback):
+        pass
+
+
+class ShardCoordinator(object):
+    # Every replica renews its own Lease object. Replicas with an unexpired
+    # lease form a consistent hash ring and each gateway is handled by the
+    # replica that owns its name on the ring.
+    def __init__(self, kubeconfig_path, kube_namespace, replica_id,
+                 lease_duration=DEFAULT_LEASE_DURATION,
+                 renew_interval=DEFAULT_RENEW_INTERVAL):
+        self.kubeconfig_path = kubeconfig_path
+        self.kube_namespace = kube_namespace
+        self.replica_id = replica_id
+        self.lease_name = LEASE_NAME_PREFIX + replica_id
+        self.lease_duration = lease_duration
+        self.renew_interval = renew_interval
+
+        self._ring = HashRing([replica_id])
+        # monotonic time of the last successful renewal of our lease
+        self._renewed_at = None
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._heartbeat()
+        thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        try:
+            k8s_tools.delete_lease(self.kubeconfig_path,
+                                   self.kube_namespace,
+                                   self.lease_name)
+        except Exception as e:
+            LOG.warning('Can not delete lease {lease}: {err}'.format(
+                lease=self.lease_name, err=e))
+
+    def has_lease(self):
+        # Other replicas drop us from their rings once our lease expires,
+        # so nothing is owned without a fresh renewal.
+        with self._lock:
+            renewed_at = self._renewed_at
+        return renewed_at is not None and \
+            time.monotonic() - renewed_at < self.lease_duration
+
+    def owns(self, gw_name):
+        if not self.has_lease():
+            return False
+        with self._lock:
+            ring = self._ring
+        return ring.get_owner(gw_name) == self.replica_id
+
+    def get_members(self):
+        with self._lock:
+            return sorted(self._ring.members)
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def _heartbeat_loop(self):
+        while not self._stopped.wait(self.renew_interval):
+            try:
+                self._heartbeat()
+            except Exception as e:
+                LOG.error('Shard heartbeat failed: {err}'.format(err=e))
+                if not self.has_lease():
+                    LOG.error('Lease {lease} expired, gateways are not '
+                              'handled until it is renewed'.format(
+                                  lease=self.lease_name))
+
+    def _heartbeat(self):
+        started_at = time.monotonic()
+        now = _utcnow()
+        lease = k8s_tools.renew_lease(self.kubeconfig_path,
+                                      self.kube_namespace,
+                                      self.lease_name,
+                                      self.replica_id,
+                                      self.lease_duration,
+                                      now)
+        if lease is None:
+            k8s_tools.create_lease(self.kubeconfig_path,
+                                   self.kube_namespace,
+                                   self.lease_name,
+                                   LEASE_LABELS,
+                                   self.replica_id,
+                                   self.lease_duration,
+                                   now)
+        with self._lock:
+            self._renewed_at = started_at
+
+        members = set([self.replica_id])
+        selector = ','.join('{k}={v}'.format(k=k, v=v)
+                            for k, v in LEASE_LABELS.items())
+        for lease in k8s_tools.list_leases(self.kubeconfig_path,
+                                           self.kube_namespace,
+                                           selector):
+            spec = lease.spec
+            if not spec.holder_identity or not spec.renew_time:
+                continue
+            duration = spec.lease_duration_seconds or self.lease_duration
+            expires = spec.renew_time + datetime.timedelta(seconds=duration)
+            if expires > now:
+                members.add(spec.holder_identity)
+        self._update_members(members)
+
+    def _update_members(self, members):
+        with self._lock:
+            if members == self._ring.members:
+                return
+            old_members = self._ring.members
+            self._ring = HashRing(members)
+        LOG.info('Shard members changed from {old} to {new}'.format(
+            old=sorted(old_members), new=sorted(members)))
+        for callback in self._listeners:
+            callback(sorted(members))
+
+
+def get_replica_id():
+    return os.environ.get('POD_NAME') or socket.gethostname()
+
+
+def get_shard(conf):
+    sharding_conf = conf.get('sharding')
+    if not sharding_conf or not sharding_conf.get('enabled', False):
+        return SingleReplica()
+    # leases are kept in the first cluster the tool watches
+    target = k8s_tools.get_targets(conf.k8s)[0]
+    return ShardCoordinator(
+        target.kubeconfig_path,
+        sharding_conf.get('namespace', target.namespace),
+        sharding_conf.get('replica_id') or get_replica_id(),
+        lease_duration=sharding_conf.get('lease_duration',
+                                         DEFAULT_LEASE_DURATION),
+        renew_interval=sharding_conf.get('renew_interval',
+                                         DEFAULT_RENEW_INTERVAL))
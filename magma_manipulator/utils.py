@@ -16,10 +16,12 @@ from io import StringIO
 import json
 import logging
 import os
-
-import paramiko
+import socket
+import threading
+import time
 
 from magma_manipulator import exceptions
+from magma_manipulator import logs
 
 
 LOG = logging.getLogger(__name__)
@@ -33,47 +35,130 @@ GET_GW_UUID_CMD = 'cd /var/opt/magma/docker ; '\
                   'sudo docker-compose exec '\
                   '-T magmad /usr/local/bin/show_gateway_info.py'
 
+SSH_CONNECT_TIMEOUT = 10
+# seconds a remote command may go without output, e.g. a hung docker-compose
+SSH_COMMAND_TIMEOUT = 60
+# connections opened for pods that are never registered are closed after
+SSH_IDLE_TIMEOUT = 300
+
+_ssh_clients = {}
+_ssh_used_at = {}
+_pkeys = {}
+_ssh_lock = threading.Lock()
+
 
 def is_gw_reachable(gw_ip):
     response = os.system('ping -c 1 ' + gw_ip)
     return response == 0
 
 
+def _load_pkey(rsa_private_key_path):
+    import paramiko
+
+    with _ssh_lock:
+        if rsa_private_key_path not in _pkeys:
+            with open(rsa_private_key_path, 'r') as f:
+                s = f.read()
+            _pkeys[rsa_private_key_path] = paramiko.RSAKey(
+                file_obj=StringIO(s))
+        return _pkeys[rsa_private_key_path]
+
+
+def open_ssh_connection(server, username, rsa_private_key_path):
+    # Connections are kept open and reused by the following commands to the
+    # same gateway until close_ssh_connection() or an error.
+    import paramiko
+
+    with _ssh_lock:
+        client = _ssh_clients.get((server, username))
+        _ssh_used_at[(server, username)] = time.monotonic()
+    if _is_active(client):
+        return client
+
+    pkey = _load_pkey(rsa_private_key_path)
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    LOG.debug('Connection to server %s', server, extra=logs.RATE_LIMITED)
+    client.connect(server, username=username, pkey=pkey,
+                   timeout=SSH_CONNECT_TIMEOUT)
+
+    with _ssh_lock:
+        old_client = _ssh_clients.get((server, username))
+        if _is_active(old_client):
+            # another thread connected meanwhile and may be using it
+            unused_client, client = client, old_client
+        else:
+            _ssh_clients[(server, username)] = client
+            unused_client = old_client
+        _ssh_used_at[(server, username)] = time.monotonic()
+    if unused_client is not None:
+        unused_client.close()
+    return client
+
+
+def _is_active(client):
+    if client is None:
+        return False
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+
+def close_ssh_connection(server, username):
+    with _ssh_lock:
+        client = _ssh_clients.pop((server, username), None)
+        _ssh_used_at.pop((server, username), None)
+    if client is not None:
+        client.close()
+
+
+def close_idle_ssh_connections(max_idle=SSH_IDLE_TIMEOUT):
+    now = time.monotonic()
+    with _ssh_lock:
+        idle = [conn for conn, used_at in _ssh_used_at.items()
+                if now - used_at > max_idle]
+        clients = [_ssh_clients.pop(conn, None) for conn in idle]
+        for conn in idle:
+            del _ssh_used_at[conn]
+    for client in clients:
+        if client is not None:
+            client.close()
+    if idle:
+        LOG.info('Closed %d idle SSH connections', len(idle))
+
+
 def exec_ssh_command(server, username, rsa_private_key_path, command):
-    client = None
     try:
-        with open(rsa_private_key_path, 'r') as f:
-            s = f.read()
-        pkey = paramiko.RSAKey(file_obj=StringIO(s))
-
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        LOG.debug('Connection to server {server} '
-                  'to execute command "{cmd}"'.format(server=server,
-                                                      cmd=command))
-        client.connect(server, username=username, pkey=pkey)
-        ssh_stdin, ssh_stdout, ssh_stderr = client.exec_command(command)
+        client = open_ssh_connection(server, username, rsa_private_key_path)
+        LOG.debug('Execute command "%s" on server %s', command, server,
+                  extra=logs.RATE_LIMITED)
+        ssh_stdin, ssh_stdout, ssh_stderr = client.exec_command(
+            command, timeout=SSH_COMMAND_TIMEOUT)
 
         return ssh_stdout.read().decode('ascii')
+    except socket.timeout:
+        close_ssh_connection(server, username)
+        msg = 'Execution ssh command "{cmd}" on server {server} timed out '\
+              'after {timeout}s'.format(cmd=command, server=server,
+                                        timeout=SSH_COMMAND_TIMEOUT)
+        LOG.error(msg)
+        raise exceptions.SshTimeoutException(msg)
     except Exception as e:
+        close_ssh_connection(server, username)
         msg = 'Execution ssh command "{cmd}" on server {server}'\
               'returns {msg}'.format(cmd=command, server=server, msg=e)
         LOG.error(msg)
         raise exceptions.SshRemoteCommandException(msg)
-    finally:
-        if client:
-            client.close()
 
 
 def is_cloud_init_done(gw_ip, gw_username, rsa_private_key_path):
-    LOG.info('Check cloud-init status on gatewat {gw_ip}'.format(gw_ip=gw_ip))
+    LOG.info('Check cloud-init status on gateway %s', gw_ip,
+             extra=logs.RATE_LIMITED)
     result = exec_ssh_command(gw_ip,
                               gw_username,
                               rsa_private_key_path,
                               CLOUD_INIT_CHECK_CMD)
-    LOG.info('Cloud-init status: {status} on gateway {gw_ip}'.format(
-        status=result,
-        gw_ip=gw_ip))
+    LOG.info('Cloud-init status: %s on gateway %s', result, gw_ip,
+             extra=logs.RATE_LIMITED)
     if CLOUD_INIT_DONE in result:
         return True
     elif CLOUD_INIT_RUNNING in result:
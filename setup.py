@@ -8,6 +8,10 @@ setup(
                       'kubernetes==10.0.1',
                       'paramiko==2.6.0',
                       'requests==2.22.0'],
+    extras_require={
+        # faster decoding and incremental parsing of orc8r responses
+        'fast-json': ['orjson', 'ijson>=3.1'],
+    },
 
     entry_points={
         'console_scripts': [
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 Mirantis Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+# Decoding of a synthetic orc8r gateways listing with the old
+# json.loads(content.decode('ascii')) path and with json_codec. Run from
+# the repository root:
+#     python3 tools/bench_decode.py --count 20000
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from magma_manipulator import json_codec  # noqa: E402
+
+
+def make_listing(count):
+    gws = {}
+    for i in range(count):
+        gw_id = 'gw-id-{i}'.format(i=i)
+        gws[gw_id] = {
+            'id': gw_id,
+            'name': 'cwf-gw-{i}'.format(i=i),
+            'description': 'Gateway was created from magma-manipulator',
+            'device': {
+                'hardware_id': '{i:08x}-1c1f-4b3e-9d52-2d1c3b7a9e10'.format(
+                    i=i),
+                'key': {'key': 'MHYwEAYHKoZIzj0CAQYFK4EEACIDYgAE' * 4,
+                        'key_type': 'SOFTWARE_ECDSA_SHA256'},
+            },
+            'magmad': {'autoupgrade_enabled': True,
+                       'autoupgrade_poll_interval': 300,
+                       'checkin_interval': 60,
+                       'checkin_timeout': 10,
+                       'dynamic_services': [],
+                       'feature_flags': {'newfeature1': True}},
+            'carrier_wifi': {'allowed_gre_peers': [{'ip': '192.168.127.1',
+                                                    'key': 1}]},
+            'status': {'checkin_time': 1571400000000 + i,
+                       'hardware_id': 'hw-{i}'.format(i=i),
+                       'meta': {'rf_state': 'on'}},
+            'tier': 'default',
+        }
+    return json.dumps(gws).encode('utf-8')
+
+
+def old_path(content):
+    return len(json.loads(content.decode('ascii')))
+
+
+def codec_loads(content):
+    return len(json_codec.loads(content))
+
+
+def codec_iter_items(content):
+    count = 0
+    for gw_id, gw_desc in json_codec.iter_items(io.BytesIO(content)):
+        count += 1
+    return count
+
+
+def measure(func, content, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(content)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    func(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare decoding paths of orc8r gateway listings')
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    content = make_listing(args.count)
+    ijson = json_codec._get_ijson()
+    print('{count} gateways, {size:.1f} MB listing, codec {codec}, '
+          'ijson backend {backend}'.format(
+              count=args.count, size=len(content) / 1e6,
+              codec=json_codec._get_loads().__module__,
+              backend=ijson.backend if ijson else None))
+    for name, func in (('json.loads(decode)', old_path),
+                       ('json_codec.loads', codec_loads),
+                       ('json_codec.iter_items', codec_iter_items)):
+        best, peak = measure(func, content, args.repeat)
+        print('{name:<22} {sec:.3f}s  peak {peak:.1f} MiB'.format(
+            name=name, sec=best, peak=peak / 2.0 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 Mirantis Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+# Cold import time of magma_manipulator.main, measured in a fresh
+# interpreter for every run. Fails if a heavy dependency is imported at
+# module level. Run from the repository root:
+#     python3 tools/bench_import.py --repeat 10
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('kubernetes', 'paramiko', 'requests', 'yaml', 'jsonschema')
+
+CHILD_CODE = '''
+import json, sys, time
+start = time.perf_counter()
+import magma_manipulator.main
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(sys.modules)}))
+'''
+
+
+def import_once():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in (REPO_DIR, env.get('PYTHONPATH')) if p)
+    # no config file is needed to import the tool
+    env.pop('MAGMA_MANIPULATOR_CONFIG', None)
+    output = subprocess.check_output(
+        [sys.executable, '-c', CHILD_CODE], env=env, cwd=REPO_DIR)
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure cold import time of magma_manipulator.main')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    times = []
+    for _ in range(args.repeat):
+        result = import_once()
+        loaded = [name for name in HEAVY_MODULES
+                  if name in result['modules']]
+        assert not loaded, \
+            'heavy modules imported at startup: {mods}'.format(mods=loaded)
+        times.append(result['elapsed'])
+
+    times.sort()
+    print('import magma_manipulator.main: best {best:.1f}ms, median '
+          '{median:.1f}ms over {count} runs, none of {mods} loaded'.format(
+              best=times[0] * 1000, median=times[len(times) // 2] * 1000,
+              count=len(times), mods=', '.join(HEAVY_MODULES)))
+
+
+if __name__ == '__main__':
+    main()
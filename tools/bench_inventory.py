@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 Mirantis Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+# Memory used per gateway by the gateways inventory and the speed of pod
+# name lookups. Run from the repository root:
+#     python3 tools/bench_inventory.py --count 100000
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from magma_manipulator import gateways  # noqa: E402
+
+
+def build_inventory(count, networks):
+    gws = []
+    for i in range(count):
+        # network names come from orc8r responses as separate strings
+        net = ''.join(['net-', str(i % networks)])
+        gws.append(gateways.Gateway(
+            'gw-id-{i}'.format(i=i), 'cwf-gw-{i}'.format(i=i),
+            net, ''.join(['carrier_wifi_', 'network']),
+            '/var/lib/gateways_configs/gw-id-{i}.json'.format(i=i),
+            fingerprint=(i * 2654435761) & (2 ** 64 - 1)))
+    return gateways.GatewayInventory(gws)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure memory and lookups of the gateways inventory')
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--networks', type=int, default=10)
+    parser.add_argument('--lookups', type=int, default=100000)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    inventory = build_inventory(args.count, args.networks)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff
+               for stat in after.compare_to(before, 'filename'))
+    print('{count} gateways: {total:.1f} MiB, {per_gw:.0f} bytes per '
+          'gateway including indexes'.format(
+              count=len(inventory), total=size / 2.0 ** 20,
+              per_gw=size / float(len(inventory))))
+
+    pod_names = ['cwf-gw-{i}-0'.format(i=i % args.count)
+                 for i in range(args.lookups)]
+    start = time.perf_counter()
+    for pod_name in pod_names:
+        inventory.match_pod_name(pod_name)
+    elapsed = time.perf_counter() - start
+    print('{lookups} pod name lookups: {sec:.3f}s, {us:.2f}us per '
+          'lookup'.format(lookups=args.lookups, sec=elapsed,
+                          us=elapsed / args.lookups * 1e6))
+
+
+if __name__ == '__main__':
+    main()